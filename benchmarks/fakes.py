@@ -0,0 +1,286 @@
+"""Local stand-ins for the Replicate and Gemini clients used by the pipeline."""
+
+import asyncio
+import contextvars
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, get_args
+
+from transcriber.audio import probe
+from transcriber.backends import (
+    INCREDIBLY_FAST_WHISPER,
+    OPENAI,
+    WHISPER_DIARIZATION,
+    WHISPERX,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+
+SEGMENT_SECONDS = 5.0
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "a", "lazy", "dog"]
+SEGMENTS_RE = re.compile(r"<input_segments>(.*)</input_segments>", re.DOTALL)
+TEXT_RE = re.compile(
+    r"<(transcribed_text|input_text)>(.*?)</\1>",
+    re.DOTALL,
+)
+
+
+class FakeServiceError(RuntimeError):
+    pass
+
+
+# Set by the benchmark around every pipeline stage
+current_stage: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_stage",
+    default="other",
+)
+
+
+class CallLog:
+    def __init__(self) -> None:
+        self.counts: dict[str, dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            stage = self.counts.setdefault(current_stage.get(), {})
+            stage[name] = stage.get(name, 0) + 1
+
+
+class Behaviour:
+    # Latency and failures of a fake service; failures are seeded, so runs repeat
+    def __init__(self, latency: float, failure_rate: float, seed: int = 0) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)  # noqa: S311
+        self._lock = threading.Lock()
+
+    async def call(self, extra_latency: float = 0) -> None:
+        await asyncio.sleep(self.latency + extra_latency)
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            msg = "Injected failure"
+            raise FakeServiceError(msg)
+
+
+def sentence(i: int) -> str:
+    return " ".join(WORDS[(i + j) % len(WORDS)] for j in range(8)) + "."
+
+
+def synthetic_segments(duration: float) -> list[dict[str, Any]]:
+    # Two speakers taking turns every few segments
+    return [
+        {
+            "start": round(start, 2),
+            "end": round(min(start + SEGMENT_SECONDS, duration), 2),
+            "speaker": f"SPEAKER_0{(i // 3) % 2}",
+            "text": sentence(i),
+        }
+        for i, start in enumerate(
+            itertools.takewhile(
+                lambda start: start < duration,
+                itertools.count(0.0, SEGMENT_SECONDS),
+            ),
+        )
+    ]
+
+
+def synthetic_output(model: str, model_input: dict[str, Any], duration: float) -> Any:
+    segments = synthetic_segments(duration)
+    if model == WHISPER_DIARIZATION:
+        return {"segments": segments, "num_speakers": 2}
+    if model == INCREDIBLY_FAST_WHISPER:
+        if not model_input.get("diarise_audio"):
+            return {"text": " ".join(s["text"] for s in segments)}
+        return [
+            {
+                "timestamp": [s["start"], s["end"]],
+                "speaker": s["speaker"],
+                "text": s["text"],
+            }
+            for s in segments
+        ]
+    if model == OPENAI:
+        return [s["text"] + " " for s in segments]
+    if model == WHISPERX:
+        return {"segments": segments, "detected_language": "en"}
+    msg = f"No fake output for {model}"
+    raise ValueError(msg)
+
+
+class FakeReplicate:
+    """Answers predictions.async_create with recorded or synthetic model outputs.
+
+    Predictions complete inside async_create() after ``latency + audio / speed``
+    seconds, so the pipeline never sleeps between polls.
+    """
+
+    def __init__(
+        self,
+        behaviour: Behaviour,
+        speed: float = 500,
+        recordings: Path | None = None,
+        calls: CallLog | None = None,
+    ) -> None:
+        self.behaviour = behaviour
+        self.speed = speed
+        self.recordings = recordings
+        self.calls = calls or CallLog()
+        self.predictions = SimpleNamespace(async_create=self._create_by_version)
+        self.files = SimpleNamespace(
+            async_create=self._create_file,
+            async_delete=self._delete_file,
+        )
+        self.models = SimpleNamespace(
+            predictions=SimpleNamespace(async_create=self._create),
+            get=self._get_model,
+        )
+        self._versions: dict[str, str] = {}
+        self._files: dict[str, Path] = {}  # by URL
+
+    def _get_model(self, model: str) -> Any:
+        self.calls.add("replicate.models.get")
+        version = self._versions.setdefault(model, uuid.uuid4().hex)
+        return SimpleNamespace(
+            versions=SimpleNamespace(list=lambda: [SimpleNamespace(id=version)]),
+        )
+
+    async def _create_file(self, file: Path) -> Any:
+        self.calls.add("replicate.files.create")
+        file.read_bytes()  # uploaded once, predictions get the URL
+        await self.behaviour.call()
+        return self._uploaded(file)
+
+    def _uploaded(self, file: Path) -> Any:
+        upload = SimpleNamespace(id=uuid.uuid4().hex, urls={})
+        upload.urls["get"] = f"https://api.replicate.invalid/v1/files/{upload.id}"
+        self._files[upload.urls["get"]] = file
+        return upload
+
+    async def _delete_file(self, file_id: str) -> bool:
+        self.calls.add("replicate.files.delete")
+        return any(
+            self._files.pop(url) for url in list(self._files) if url.endswith(file_id)
+        )
+
+    async def _create_by_version(self, version: str, **kwargs: Any) -> Any:
+        model = next(m for m, v in self._versions.items() if v == version)
+        return await self._create(model, **kwargs)
+
+    async def _create(
+        self,
+        model: str,
+        input: dict[str, Any],  # noqa: A002
+        **_: Any,
+    ) -> Any:
+        duration = await self._received(model, input)
+        created = time.time()
+        await self.behaviour.call(duration / self.speed)
+        return self._prediction(model, input, duration, created)
+
+    async def _received(self, model: str, model_input: dict[str, Any]) -> float:
+        # The duration of the audio in the input
+        self.calls.add(f"replicate {model}")
+        audio = next(
+            v for v in model_input.values() if hasattr(v, "read") or v in self._files
+        )
+        if isinstance(audio, str):
+            return (await probe(self._files[audio]))["duration"]
+        audio.read()  # the real client uploads the whole file
+        return (await probe(Path(audio.name)))["duration"]
+
+    def _prediction(
+        self,
+        model: str,
+        model_input: dict[str, Any],
+        duration: float,
+        created: float,
+    ) -> Any:
+        output = self._recorded(model) or synthetic_output(model, model_input, duration)
+
+        async def reload() -> None:
+            pass
+
+        return SimpleNamespace(
+            id=uuid.uuid4().hex,
+            status="succeeded",
+            output=output,
+            error=None,
+            metrics={"predict_time": time.time() - created},
+            created_at=None,
+            started_at=None,
+            async_reload=reload,
+        )
+
+    def _recorded(self, model: str) -> Any:
+        if self.recordings is None:
+            return None
+        path = self.recordings / (model.replace("/", "__") + ".json")
+        return json.loads(path.read_text()) if path.is_file() else None
+
+
+class FakeGemini:
+    """Echoes corrections and translations back, names speakers after labels."""
+
+    def __init__(self, behaviour: Behaviour, calls: CallLog | None = None) -> None:
+        self.behaviour = behaviour
+        self.calls = calls or CallLog()
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(
+                generate_content=self._generate,
+                generate_content_stream=self._generate_stream,
+            ),
+        )
+
+    async def _generate(self, model: str, contents: str, config: Any) -> Any:  # noqa: ARG002
+        schema = getattr(config, "response_schema", None)
+        self.calls.add("gemini " + ("json" if schema else "text"))
+        await self.behaviour.call()
+        return self._response(contents, schema)
+
+    def _response(self, contents: str, schema: Any) -> Any:
+        if schema is None:
+            return SimpleNamespace(text=self._text(contents), parsed=None)
+        item = get_args(schema)[0]
+        if "original_speaker" in item.model_fields:
+            speakers = sorted(set(re.findall(r"SPEAKER_\d+", contents)))
+            parsed = [
+                item(original_speaker=s, detected_speaker=f"Host {i + 1}")
+                for i, s in enumerate(speakers)
+            ]
+        else:
+            match = SEGMENTS_RE.search(contents)
+            segments = json.loads(match.group(1)) if match else []
+            parsed = [item(id=s["id"], text=f"[tr] {s['text']}") for s in segments]
+        return SimpleNamespace(text=None, parsed=parsed)
+
+    async def _generate_stream(
+        self,
+        model: str,  # noqa: ARG002
+        contents: str,
+        config: Any,  # noqa: ARG002
+    ) -> AsyncIterator[Any]:
+        # Awaited first, like the real client, then iterated
+        self.calls.add("gemini stream")
+        await self.behaviour.call()
+        text = self._text(contents)
+
+        async def chunks() -> AsyncIterator[Any]:
+            for i in range(0, len(text), 200):
+                yield SimpleNamespace(text=text[i : i + 200])
+
+        return chunks()
+
+    @staticmethod
+    def _text(contents: str) -> str:
+        match = TEXT_RE.search(contents)
+        return match.group(2) if match else contents
@@ -0,0 +1,142 @@
+"""Merging incredibly-fast-whisper chunks: merge_chunks vs the original app code.
+
+Run with ``pixi run benchmark-merging`` (or ``python -m benchmarks.merging``).
+Synthetic diarized output, by default about as many chunks as 5 hours of audio.
+The baseline is ``process_diarization_for_incredibly_fast_whisper`` as the
+app had it, which leaves the last chunk out, so it is compared on the chunks
+it reads.
+"""
+
+import argparse
+import random
+import sys
+import time
+from typing import TYPE_CHECKING, Any
+
+from transcriber.transcript import MAX_MERGE_GAP_SECONDS, Transcript, merge_chunks
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from transcriber.transcript import Segment
+
+
+def make_chunks(
+    count: int,
+    speakers: int,
+    change_rate: float,
+    seed: int = 1,
+) -> list[dict[str, Any]]:
+    # Runs of one speaker, with a pause longer than the merge gap as often as
+    # the speaker changes
+    rng = random.Random(seed)  # noqa: S311
+    chunks = []
+    position = 0.0
+    label = 0
+    for _ in range(count):
+        if rng.random() < change_rate:
+            label = rng.randrange(speakers)
+        position += 3.0 if rng.random() < change_rate else rng.choice((0.1, 0.5))
+        end = position + rng.uniform(1, 6)
+        chunks.append(
+            {
+                "timestamp": [position, end],
+                "speaker": f"SPEAKER_{label:02d}",
+                "text": " the quick brown fox",
+            },
+        )
+        position = end
+    return chunks
+
+
+def process_diarization_for_incredibly_fast_whisper(
+    transcription: list[dict[str, Any]],
+) -> list[dict[str, Any]]:
+    # The app's original implementation, without its st.cache_data
+    output: list[dict[str, Any]] = []
+    current_group: dict[str, Any] = {
+        "start": str(transcription[0]["timestamp"][0]),
+        "end": str(transcription[0]["timestamp"][1]),
+        "speaker": transcription[0]["speaker"],
+        "text": transcription[0]["text"],
+    }
+
+    for i in range(1, len(transcription[0:-1])):
+        time_gap = (
+            transcription[i]["timestamp"][0] - transcription[i - 1]["timestamp"][1]
+        )
+        if (
+            transcription[i]["speaker"] == transcription[i - 1]["speaker"]
+            and time_gap <= 2  # noqa: PLR2004
+        ):
+            current_group["end"] = str(transcription[i]["timestamp"][1])
+            current_group["text"] += " " + transcription[i]["text"]
+        else:
+            output.append(current_group)
+
+            current_group = {
+                "start": str(transcription[i]["timestamp"][0]),
+                "end": str(transcription[i]["timestamp"][1]),
+                "speaker": transcription[i]["speaker"],
+                "text": transcription[i]["text"],
+            }
+
+    output.append(current_group)
+    return output
+
+
+def same_segments(baseline: list[dict[str, Any]], merged: list[Segment]) -> bool:
+    return [
+        (float(g["start"]), float(g["end"]), g["speaker"], g["text"]) for g in baseline
+    ] == [(s.start, s.end, s.speaker, s.text) for s in merged]
+
+
+def best_of(repeat: int, fn: Callable[[], Any]) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--speakers", type=int, default=4)
+    parser.add_argument(
+        "--change-rate",
+        type=float,
+        nargs="+",
+        default=[0.3, 0.0],
+        help="how often the speaker changes or pauses, 0 is one long monologue",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for change_rate in args.change_rate:
+        chunks = make_chunks(args.chunks, args.speakers, change_rate)
+        # The baseline reads every chunk but the last, with a 2 s gap
+        read = chunks[:-1]
+        baseline = process_diarization_for_incredibly_fast_whisper(chunks)
+        merged = merge_chunks(read, MAX_MERGE_GAP_SECONDS)
+        if not same_segments(baseline, merged):
+            sys.exit("merge_chunks differs from the original implementation")
+        before = best_of(
+            args.repeat,
+            lambda: process_diarization_for_incredibly_fast_whisper(chunks),  # noqa: B023
+        )
+        after = best_of(args.repeat, lambda: merge_chunks(read))  # noqa: B023
+        transcript = Transcript(merged)
+        stats = best_of(args.repeat, transcript.speaker_stats)
+        sys.stdout.write(
+            f"{len(chunks)} chunks, speaker change rate {change_rate} "
+            f"-> {len(merged)} segments\n"
+            f"  original     {before * 1000:>8.1f} ms\n"
+            f"  merge_chunks {after * 1000:>8.1f} ms  ({before / after:.1f}x)\n"
+            f"  stats        {stats * 1000:>8.1f} ms\n",
+        )
+
+
+if __name__ == "__main__":
+    main()
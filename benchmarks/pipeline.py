@@ -0,0 +1,345 @@
+"""Full pipeline on synthetic audio against local Replicate and Gemini stand-ins.
+
+Run with ``pixi run benchmark-pipeline`` (or ``python -m benchmarks.pipeline``).
+No network access or API keys are needed. Every size runs in its own process,
+so peak RSS is per run. Use ``--output`` to save the results and
+``--baseline`` to fail when wall time regresses against saved results.
+"""
+
+import argparse
+import ast
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from benchmarks.fakes import (
+    Behaviour,
+    CallLog,
+    FakeGemini,
+    FakeReplicate,
+    current_stage,
+)
+from transcriber import metrics, pipeline
+from transcriber.backends import MODELS, WHISPER_DIARIZATION
+from transcriber.cache import TranscriptionCache
+from transcriber.ingest import UPLOAD_MODE
+from transcriber.jobs import Job
+from transcriber.options import JobOptions
+from transcriber.ratelimit import TokenBucket
+from transcriber.services import Services
+from transcriber.store import JobStore
+from transcriber.translation import BatchTranslator
+from transcriber.versions import ModelVersionResolver
+from transcriber.worker import Worker
+
+SIZES = {"1m": 60, "1h": 3600, "5h": 5 * 3600}
+AUDIO_DIR = Path(".cache/benchmarks")
+APP = Path(__file__).parent.parent / "src" / "streamlit_app.py"
+# Loaded by the worker on first use, not by the app's first page
+LAZY_MODULES = [
+    "transcriber.worker",
+    "replicate",
+    "google.genai",
+    "yt_dlp",
+    "bs4",
+    "curl_cffi",
+]
+PROFILED_MODULES = ("streamlit", "pydantic", "httpx", *LAZY_MODULES)
+
+
+def make_audio(seconds: int) -> Path:
+    # Speech-like bursts with a 2 s pause every 30 s, so chunking finds cuts.
+    # Generated once and reused, encoding 5 hours takes a while.
+    path = AUDIO_DIR / f"synthetic-{seconds}s.ogg"
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"anoisesrc=amplitude=0.3:duration={seconds}",
+            "-af",
+            "volume='if(lt(mod(t,30),28),1,0)':eval=frame",
+            "-ac",
+            "2",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            "32k",
+            str(path.with_suffix(".tmp.ogg")),
+        ],
+        check=True,
+    )
+    path.with_suffix(".tmp.ogg").replace(path)
+    return path
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run_one(args: argparse.Namespace) -> dict[str, Any]:
+    audio = make_audio(SIZES[args.size])
+    calls = CallLog()
+    gemini: Any = FakeGemini(
+        Behaviour(args.gemini_latency, args.failure_rate, seed=1),
+        calls,
+    )
+    replicate: Any = FakeReplicate(
+        Behaviour(args.replicate_latency, args.failure_rate, seed=2),
+        speed=args.replicate_speed,
+        recordings=args.recordings,
+        calls=calls,
+    )
+    # Count external calls by the stage that made them
+    for stages in (pipeline.STAGES, pipeline.COMPARE_STAGES):
+        for name, run_stage in list(stages.items()):
+
+            async def staged(
+                run: Any,
+                name: str = name,
+                run_stage: Any = run_stage,
+            ) -> None:
+                token = current_stage.set(name)
+                try:
+                    await run_stage(run)
+                finally:
+                    current_stage.reset(token)
+
+            stages[name] = staged
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        services = Services(
+            gemini_client=gemini,
+            replicate_client=replicate,
+            hf_access_token="benchmark",  # noqa: S106
+            cache=TranscriptionCache(workdir / "cache.sqlite3", max_bytes=2**30),
+            translator=BatchTranslator(
+                gemini,
+                "benchmark",
+                TokenBucket(args.gemini_rpm, capacity=args.gemini_rpm),
+            ),
+            versions=ModelVersionResolver(replicate),
+        )
+        store = JobStore(workdir / "jobs.sqlite3")
+        job = Job.create(workdir / "jobs")
+        (job.workdir / "upload.ogg").symlink_to(audio.resolve())
+        options = JobOptions(
+            mode=UPLOAD_MODE,
+            source="upload.ogg",
+            model_name=args.model,
+            language=args.language,
+            chunking=args.chunking,
+            chunk_minutes=args.chunk_minutes,
+            streaming=args.streaming,
+            trim_silence=args.trim_silence,
+            tempo=args.tempo,
+            compare=args.compare,
+        )
+        store.create(job.id, job.workdir, options.model_dump())
+        worker = Worker(services, store, max_jobs=1)
+        started = time.perf_counter()
+        record = store.claim(worker.id, lease=3600)
+        assert record is not None  # noqa: S101
+        worker.process(record)
+        wall = time.perf_counter() - started
+        result = store.get(job.id)
+        assert result is not None  # noqa: S101
+
+    summary = metrics.registry.summary()
+    return {
+        "size": args.size,
+        "model": args.model,
+        "status": result.status,
+        "error": result.error,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_child_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "stages": {
+            name.removeprefix("stage."): round(stats["sum"], 3)
+            for name, stats in summary.items()
+            if name.startswith("stage.")
+        },
+        "calls": calls.counts,
+        "encoding": result.state.get("encoding"),
+    }
+
+
+def app_imports() -> list[str]:
+    # Module-level imports of the app, what every cold start pays for
+    modules = []
+    for node in ast.parse(APP.read_text()).body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+
+def import_profile(modules: list[str]) -> dict[str, float]:
+    # Import times in ms from a fresh interpreter (python -X importtime)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        check=True,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, sys.path))},
+    ).stderr
+    profile = {"total": 0.0}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        if not name.startswith("  "):  # top level, the rest is nested in it
+            profile["total"] += int(cumulative) / 1000
+        if name.strip() in PROFILED_MODULES:
+            profile[name.strip()] = int(cumulative) / 1000
+    return profile
+
+
+def report_imports() -> None:
+    for label, modules in (("app", app_imports()), ("worker", LAZY_MODULES)):
+        profile = import_profile(modules)
+        parts = ", ".join(
+            f"{name} {ms:.0f}" for name, ms in profile.items() if name != "total"
+        )
+        sys.stdout.write(
+            f"imports {label:<6} {profile['total']:>6.0f} ms  ({parts})\n",
+        )
+
+
+def run_all(args: argparse.Namespace) -> list[dict[str, Any]]:
+    results = []
+    for size in args.sizes.split(","):
+        for model in args.models.split(","):
+            command = [
+                sys.executable,
+                "-m",
+                "benchmarks.pipeline",
+                *sys.argv[1:],
+                "--run-one",
+                "--size",
+                size,
+                "--model",
+                model,
+            ]
+            output = subprocess.run(
+                command,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.splitlines()[-1]))
+            report(results[-1])
+    return results
+
+
+def report(result: dict[str, Any]) -> None:
+    stages = " ".join(f"{k}={v:.2f}s" for k, v in result["stages"].items())
+    sys.stdout.write(
+        f"{result['size']:>3} {result['model']:<36} {result['status']:<6} "
+        f"wall {result['wall_seconds']:>8.2f}s  rss {result['peak_rss_mb']:>6.1f} MB  "
+        f"ffmpeg rss {result['peak_child_rss_mb']:>6.1f} MB\n    {stages}\n",
+    )
+    if encoding := result.get("encoding"):
+        sys.stdout.write(
+            f"    encoding: {encoding['action']}, {encoding['segments']} segment(s), "
+            f"{encoding['seconds']:.2f}s\n",
+        )
+    for stage, counts in result["calls"].items():
+        calls = ", ".join(f"{name} x{n}" for name, n in sorted(counts.items()))
+        sys.stdout.write(f"    {stage}: {calls}\n")
+    if result["error"]:
+        sys.stdout.write(f"    error: {result['error'].splitlines()[0]}\n")
+
+
+def regressions(
+    results: list[dict[str, Any]],
+    baseline: list[dict[str, Any]],
+    tolerance: float,
+) -> list[str]:
+    previous = {(r["size"], r["model"]): r for r in baseline}
+    slower = []
+    for result in results:
+        old = previous.get((result["size"], result["model"]))
+        if old and result["wall_seconds"] > old["wall_seconds"] * (1 + tolerance):
+            slower.append(
+                f"{result['size']} {result['model']}: "
+                f"{old['wall_seconds']:.2f}s -> {result['wall_seconds']:.2f}s",
+            )
+    return slower
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1m,1h", help=f"of {', '.join(SIZES)}")
+    parser.add_argument("--models", default=WHISPER_DIARIZATION, help="or 'all'")
+    parser.add_argument("--language", default=None, help="translate to it")
+    parser.add_argument("--chunking", action="store_true")
+    parser.add_argument("--chunk-minutes", type=int, default=20)
+    parser.add_argument("--no-streaming", dest="streaming", action="store_false")
+    parser.add_argument("--trim-silence", action="store_true")
+    parser.add_argument("--tempo", type=float, default=1.0)
+    parser.add_argument("--compare", action="store_true", help="all models at once")
+    parser.add_argument("--replicate-latency", type=float, default=0.5)
+    parser.add_argument(
+        "--replicate-speed",
+        type=float,
+        default=500,
+        help="audio seconds transcribed per second",
+    )
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--gemini-rpm", type=float, default=6000)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument(
+        "--recordings",
+        type=Path,
+        help="directory of recorded outputs named owner__model.json",
+    )
+    parser.add_argument("--output", type=Path, help="save results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare with saved results")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", help=argparse.SUPPRESS)
+    parser.add_argument("--model", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.models == "all":
+        args.models = ",".join(MODELS)
+
+    if args.run_one:
+        sys.stdout.write(json.dumps(run_one(args)) + "\n")
+        return
+    report_imports()
+    results = run_all(args)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        slower = regressions(
+            results,
+            json.loads(args.baseline.read_text()),
+            args.tolerance,
+        )
+        for line in slower:
+            sys.stdout.write(f"REGRESSION {line}\n")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
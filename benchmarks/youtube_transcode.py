@@ -0,0 +1,103 @@
+"""CPU cost of the YouTube ingest path: mp3 intermediate vs a single conversion.
+
+Run with ``pixi run benchmark-youtube`` (or ``python -m benchmarks.youtube_transcode``).
+"""
+
+import argparse
+import asyncio
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from transcriber.audio import OPUS_ARGS, convert_to_opus
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+def ffmpeg(*args: str) -> None:
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args],
+        check=True,
+    )
+
+
+def make_youtube_like_audio(path: Path, minutes: float) -> None:
+    # Stereo Opus in WebM at ~64 kbps, what YouTube typically serves as worstaudio
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=frequency=220:duration={minutes * 60}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"anoisesrc=amplitude=0.05:duration={minutes * 60}",
+        "-filter_complex",
+        "amix=inputs=2,aformat=channel_layouts=stereo",
+        "-c:a",
+        "libopus",
+        "-b:a",
+        "64k",
+        str(path),
+    )
+
+
+def children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def old_pipeline(source: Path, workdir: Path) -> None:
+    mp3 = workdir / "audio.mp3"
+    # yt-dlp FFmpegExtractAudio with preferredcodec=mp3 and default quality
+    ffmpeg("-i", str(source), "-vn", "-acodec", "libmp3lame", "-q:a", "5", str(mp3))
+    ffmpeg("-i", str(mp3), *OPUS_ARGS, str(workdir / "old.ogg"))
+
+
+def new_pipeline(source: Path, workdir: Path) -> None:
+    asyncio.run(convert_to_opus(source, workdir / "new.ogg"))
+
+
+def measure(name: str, run: Callable[[], None], hours: float, rounds: int) -> None:
+    cpu, wall = [], []
+    for _ in range(rounds):
+        cpu_start, wall_start = children_cpu_seconds(), time.perf_counter()
+        run()
+        cpu.append(children_cpu_seconds() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    sys.stdout.write(
+        f"{name:<12} {min(cpu) / hours:>10.1f} {min(wall) / hours:>10.1f}\n",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    hours = args.minutes / 60
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        source = workdir / "audio.webm"
+        make_youtube_like_audio(source, args.minutes)
+        sys.stdout.write(
+            f"{args.minutes:g} min of stereo Opus/WebM, best of {args.rounds}\n",
+        )
+        sys.stdout.write(f"{'pipeline':<12} {'cpu s/h':>10} {'wall s/h':>10}\n")
+        measure("mp3 + opus", lambda: old_pipeline(source, workdir), hours, args.rounds)
+        measure(
+            "single step",
+            lambda: new_pipeline(source, workdir),
+            hours,
+            args.rounds,
+        )
+
+
+if __name__ == "__main__":
+    main()
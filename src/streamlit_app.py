@@ -1,474 +1,313 @@
 import json
-import os
-import subprocess
-import time
+import logging
+import shutil
 from pathlib import Path
-from textwrap import dedent
-from typing import TYPE_CHECKING, Any, cast
+from typing import TYPE_CHECKING, Any
 
-import httpx
-import replicate
 import streamlit as st
-from bs4 import BeautifulSoup
-from curl_cffi import requests
-from curl_cffi.requests.utils import requote_uri
-from google import genai
-from google.genai import types
-from pydantic import BaseModel
-from yt_dlp import YoutubeDL
 
-if TYPE_CHECKING:
-    from streamlit.runtime.uploaded_file_manager import UploadedFile
-
-# Google Gemini config
-gemini_api_key = os.environ["GEMINI_API_KEY"]
-gemini_client = genai.Client(api_key=gemini_api_key)
-GEMINI_MODEL = "gemini-3.7-flash"
-THINKING_CONFIG = types.ThinkingConfig(thinking_level=types.ThinkingLevel.HIGH)
-
-
-# Replicate.com config
-replicate_api_token = os.environ["REPLICATE_API_TOKEN"]
-replicate_client = replicate.Client(
-    api_token=replicate_api_token,
+from transcriber import export, settings
+from transcriber.audio import CHUNK_SIZE
+from transcriber.backends import (
+    INCREDIBLY_FAST_WHISPER,
+    OPENAI,
+    WHISPER_DIARIZATION,
+    WHISPERX,
+)
+from transcriber.cache import transcription_cache
+from transcriber.ingest import LINK_MODE, UPLOAD_MODE
+from transcriber.jobs import Job
+from transcriber.memory import translation_memory
+from transcriber.options import JobOptions
+from transcriber.store import (
+    DONE,
+    FAILED,
+    FINAL_STATUSES,
+    QUEUED,
+    JobRecord,
+    JobStore,
+    job_store,
 )
+from transcriber.transcript import Transcript
+from transcriber.trimming import MAX_TEMPO
 
-# HuggingFace.co config
-hf_access_token = os.environ["HF_ACCESS_TOKEN"]
+if TYPE_CHECKING:
+    from collections.abc import Callable
 
-# Proxy config
-proxy = os.environ.get("PROXY")
+    from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-# Constants
-AUDIO_FILE_NAME = "audio.mp3"
-CONVERTED_FILE_NAME = "audio.ogg"
-WHISPER_DIARIZATION = "thomasmol/whisper-diarization"
-INCREDIBLY_FAST_WHISPER = "vaibhavs10/incredibly-fast-whisper"
-OPENAI = "openai/gpt-4o-transcribe"
-WHISPERX = "victor-upmeet/whisperx"
+    from transcriber.cache import TranscriptionCache
+    from transcriber.memory import TranslationMemory
+    from transcriber.services import Services
+    from transcriber.worker import Worker
 
+logger = logging.getLogger(__name__)
 
-class SpeakerMapping(BaseModel):
-    original_speaker: str
-    detected_speaker: str
+# Constants
+POLL_INTERVAL_SECONDS = 2
+STAGE_MESSAGES = {
+    "download": "Uploading the file to the server...",
+    "trim": "Removing silences...",
+    "transcribe": "Transcribing...",
+    "post_processing": "Post-processing...",
+    "speakers": "Identifying speakers...",
+    "translate": "Translating...",
+    "compare": "Transcribing with all models...",
+}
 
 
 # Initialization
 if "mode" not in st.session_state:
-    st.session_state.mode = "YouTube or link to an audio file"
+    st.session_state.mode = LINK_MODE
     st.session_state.language = None
     st.session_state.model_name = WHISPER_DIARIZATION
     st.session_state.post_processing = True
     st.session_state.diarization = True
     st.session_state.speaker_identification = True
     st.session_state.raw_json = False
+    st.session_state.chunking = False
+    st.session_state.chunk_minutes = 20
+    st.session_state.streaming = True
+    st.session_state.trim_silence = False
+    st.session_state.tempo = 1.0
+    st.session_state.compare = False
+    # A reloaded page keeps following the job from the link
+    st.session_state.job_id = st.query_params.get("job")
 
 
 # Functions
-def download(url: Any, mode: str = st.session_state.mode) -> None:
-    with st.spinner("Uploading the file to the server..."):
-        if mode == "Uploaded file":
-            with Path(AUDIO_FILE_NAME).open("wb") as f:
-                f.write(url.getbuffer())
-        if mode == "YouTube or link to an audio file":
-            if url.startswith(("https://www.youtube.com/", "https://youtu.be/")):
-                ydl_opts = {
-                    "format": "worstaudio",
-                    "outtmpl": "audio",
-                    "proxy": proxy,
-                    "postprocessors": [
-                        {  # Extract audio using ffmpeg
-                            "key": "FFmpegExtractAudio",
-                            "preferredcodec": "mp3",
-                        },
-                    ],
-                }
-                with YoutubeDL(ydl_opts) as ydl:
-                    ydl.download(url)
-            else:
-                if url.startswith("https://castro.fm/episode/"):
-                    source = BeautifulSoup(
-                        requests.get(
-                            requote_uri(url),
-                            impersonate="chrome",
-                            verify=True,
-                            timeout=120,
-                        ).content,
-                        "html.parser",
-                    ).source
-                    if source is not None:
-                        src = source.get("src")
-                        if not isinstance(src, str):
-                            st.error("Could not extract audio URL from castro.fm page", icon="🚨")
-                            st.stop()
-                        url = src
-                downloaded_file = requests.get(
-                    requote_uri(url),
-                    impersonate="chrome",
-                    verify=True,
-                    timeout=120,
-                )
-                with Path(AUDIO_FILE_NAME).open("wb") as f:
-                    f.write(downloaded_file.content)
-
-
-def compress_audio(
-    audio_file_name: str = AUDIO_FILE_NAME,
-    converted_file_name: str = CONVERTED_FILE_NAME,
+@st.cache_resource(show_spinner=False)
+def get_cache() -> TranscriptionCache:
+    return transcription_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_translation_memory() -> TranslationMemory:
+    return translation_memory()
+
+
+@st.cache_resource(show_spinner=False)
+def get_services() -> Services:
+    # Replicate and Gemini clients and the pipeline are imported on first use,
+    # the first page of a cold start is rendered without them
+    from transcriber.services import Services
+
+    return Services.from_env(cache=get_cache())
+
+
+@st.cache_resource(show_spinner=False)
+def get_store() -> JobStore:
+    return job_store()
+
+
+@st.cache_resource(show_spinner=False)
+def get_worker() -> Worker | None:
+    # Set RUN_WORKER=false when workers run as separate processes
+    if not settings.run_worker:
+        return None
+    from transcriber.worker import Worker
+
+    worker = Worker(get_services(), get_store())
+    worker.start()
+    return worker
+
+
+def submit(data_input: UploadedFile | str) -> str:
+    # The in-process worker starts with the first job, not with the first page
+    get_worker()
+    job = Job.create(settings.jobs_dir)
+    if isinstance(data_input, str):
+        source = data_input.strip()
+    else:
+        # Saved under a fixed name so it can't clash with the job's own files
+        source = "upload" + Path(data_input.name).suffix.lower()
+        data_input.seek(0)
+        with (job.workdir / source).open("wb") as f:
+            shutil.copyfileobj(data_input, f, CHUNK_SIZE)
+    options = JobOptions(
+        mode=st.session_state.mode,
+        source=source,
+        model_name=st.session_state.model_name,
+        language=st.session_state.language,
+        diarization=st.session_state.diarization,
+        post_processing=st.session_state.post_processing,
+        speaker_identification=st.session_state.speaker_identification,
+        chunking=st.session_state.chunking,
+        chunk_minutes=st.session_state.chunk_minutes,
+        streaming=st.session_state.streaming,
+        trim_silence=st.session_state.trim_silence,
+        tempo=st.session_state.tempo,
+        compare=st.session_state.compare,
+    )
+    get_store().create(job.id, job.workdir, options.model_dump())
+    return job.id
+
+
+def convert_to_minutes(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}:{int(seconds):02d}"
+
+
+def render_text(state: dict[str, Any], options: JobOptions) -> None:
+    text = state.get("translation", state.get("text"))
+    if options.language is not None and "translation" not in state:
+        text = None  # the translation replaces the text once it starts
+    if text:
+        st.markdown(text.replace("$", r"\$"))
+
+
+def render_segments(
+    transcript: Transcript,
+    state: dict[str, Any],
+    options: JobOptions,
 ) -> None:
-    try:
-        subprocess.run(
-            [
-                "ffmpeg",  # /usr/bin/ffmpeg
-                "-y",
-                "-i",
-                audio_file_name,
-                "-vn",
-                "-ac",
-                "1",
-                "-c:a",
-                "libopus",
-                "-b:a",
-                "16k",
-                converted_file_name,
-            ],
-            check=True,
-            capture_output=False,
-            text=True,
-        )
-    except subprocess.CalledProcessError as e:
-        st.error("Check uploaded file 👀", icon="🚨")
-        st.write(e.stderr)
-        st.stop()
-
-
-@st.cache_data(show_spinner=False)
-def correct_transcription(
-    transcription: str,
-    post_processing: bool = st.session_state.post_processing,
-) -> str:
-    if post_processing:
-        prompt = f"Correct any spelling discrepancies in the transcribed text. Split text by speaker. Only add necessary punctuation such as periods, commas, and capitalization, and use only the context provided: <transcribed_text>{transcription}</transcribed_text>"
-        response = gemini_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=None,
-                response_mime_type="text/plain",
-                thinking_config=THINKING_CONFIG,
+    segments = transcript.segments
+    names = state.get("names")
+    texts: list[str | None] = [segment.text for segment in segments]
+    if options.language is not None:
+        texts = state.get("translations", [])
+    lines: list[str] = []
+    # Segments are shown in order as soon as their translation is ready
+    for segment, text in zip(segments, texts, strict=False):
+        if text is None:
+            break
+        label = convert_to_minutes(segment.start)
+        if names is not None:
+            label += f" - {names.get(segment.speaker, segment.speaker)}"
+        lines.append(f"**{label}:** {text.replace('$', r'\$')}")
+    if lines:
+        st.markdown("\n\n".join(lines))
+    if len(lines) == len(segments) and any(segment.speaker for segment in segments):
+        stats = transcript.speaker_stats()
+        st.caption(
+            "Talk time: "
+            + " · ".join(
+                f"{(names or {}).get(name, name)} {convert_to_minutes(stat.talk_seconds)} "
+                f"({stat.turns} turns)"
+                for name, stat in stats.items()
             ),
         )
-        if response.text is not None:
-            return response.text
-    return transcription
-
-
-def get_latest_model_version(model_name: str) -> str:
-    return replicate_client.models.get(model_name).versions.list()[0].id
-
-
-def get_latest_prediction_output(sleep_time: int = 10) -> Any:
-    transcription = None
-    while transcription is None:
-        try:
-            transcription = replicate_client.predictions.list().results[0].output
-        except TypeError, httpx.ReadTimeout:
-            time.sleep(sleep_time)
-    return transcription
-
-
-@st.cache_data(show_spinner=False)
-def detected_num_speakers(
-    transcription: Any,
-    model: str = st.session_state.model_name,
-) -> int:
-    speakers: list[Any] = []
-    if model == INCREDIBLY_FAST_WHISPER:  # for incredibly-fast-whisper only
-        speakers = [i["speaker"] for i in transcription[0:-1]]
-    elif model == WHISPERX:
-        speakers = [i["speaker"] for i in transcription["segments"][0:-1]]
-    return len(set(speakers))
-
-
-@st.cache_data(show_spinner=False)
-def process_diarization_for_incredibly_fast_whisper(
-    transcription: list[dict[str, Any]],
-) -> list[dict[str, Any]]:  # for incredibly-fast-whisper only
-    output: list[dict[str, Any]] = []
-    current_group: dict[str, Any] = {
-        "start": str(transcription[0]["timestamp"][0]),
-        "end": str(transcription[0]["timestamp"][1]),
-        "speaker": transcription[0]["speaker"],
-        "text": transcription[0]["text"],
-    }
-
-    for i in range(1, len(transcription[0:-1])):
-        time_gap = (
-            transcription[i]["timestamp"][0] - transcription[i - 1]["timestamp"][1]
-        )
-        if (
-            transcription[i]["speaker"] == transcription[i - 1]["speaker"]
-            and time_gap <= 2  # noqa: PLR2004
-        ):
-            current_group["end"] = str(transcription[i]["timestamp"][1])
-            current_group["text"] += " " + transcription[i]["text"]
-        else:
-            output.append(current_group)
-
-            current_group = {
-                "start": str(transcription[i]["timestamp"][0]),
-                "end": str(transcription[i]["timestamp"][1]),
-                "speaker": transcription[i]["speaker"],
-                "text": transcription[i]["text"],
-            }
-
-    output.append(current_group)
-    return output
-
-
-def process_whisper_diarization(audio_file_name: str = CONVERTED_FILE_NAME) -> Any:
-    with Path(audio_file_name).open("rb") as audio:
-        try:
-            transcription = replicate_client.run(
-                f"{WHISPER_DIARIZATION}:{get_latest_model_version(WHISPER_DIARIZATION)}",
-                input={"file": audio, "transcript_output_format": "segments_only"},
-            )
-        except httpx.ReadTimeout:
-            transcription = get_latest_prediction_output()
-        return transcription
-
-
-def process_incredibly_fast_whisper(
-    audio_file_name: str = CONVERTED_FILE_NAME,
-    diarization: bool = st.session_state.diarization,
-    post_processing: bool = st.session_state.post_processing,
-) -> dict[str, Any]:
-    with Path(audio_file_name).open("rb") as audio:
-        try:
-            transcription: Any = replicate_client.run(
-                f"{INCREDIBLY_FAST_WHISPER}:{get_latest_model_version(INCREDIBLY_FAST_WHISPER)}",
-                input={
-                    "audio": audio,
-                    "hf_token": hf_access_token,
-                    "diarise_audio": diarization,
-                },
-                use_file_output=False,
-            )
-        except httpx.ReadTimeout:
-            transcription = get_latest_prediction_output()
-        except:  # noqa: E722
-            st.error("Model error 😫 Try to switch the model 👍", icon="🚨")
-            st.stop()
-
-        transcription = {
-            "num_speakers": detected_num_speakers(
-                transcription,
-                model=INCREDIBLY_FAST_WHISPER,
-            )
-            if diarization
-            else 0,
-            "segments": (
-                process_diarization_for_incredibly_fast_whisper(
-                    cast("list[dict[str, Any]]", transcription),
-                )
-                if diarization
-                else correct_transcription(
-                    cast("dict[str, Any]", transcription)["text"],
-                    post_processing=post_processing,
-                )
-            ),
-        }
-        return transcription  # noqa: RET504
 
 
-def process_openai(audio_file_name: str = CONVERTED_FILE_NAME) -> dict[str, Any]:
-    with Path(audio_file_name).open("rb") as audio:
-        try:
-            transcription = replicate_client.run(
-                f"{OPENAI}",
-                input={"audio_file": audio},
+def render_comparison(comparison: list[dict[str, Any]]) -> None:
+    for column, result in zip(st.columns(len(comparison)), comparison, strict=True):
+        with column:
+            st.markdown(f"**{result['model'].split('/')[-1]}**")
+            if result["error"]:
+                st.error(result["error"], icon="🚨")
+                continue
+            cost = "cached" if result["cached"] else f"≈ ${result['cost']:.4f}"
+            st.caption(
+                f"{result['latency']:.1f} s, {result['billed_seconds']:.0f} s billed, "
+                f"{cost}".replace("$", r"\$"),
             )
-        except httpx.ReadTimeout:
-            transcription = get_latest_prediction_output()
-
-        transcription = {
-            "num_speakers": 0,
-            "segments": correct_transcription("".join(transcription)),
-        }
-
-        return transcription  # noqa: RET504
-
-
-def process_whisperx(
-    audio_file_name: str = CONVERTED_FILE_NAME,
-    diarization: bool = st.session_state.diarization,
-) -> dict[str, Any]:
-    with Path(audio_file_name).open("rb") as audio:
-        try:
-            transcription: Any = replicate_client.run(
-                f"{WHISPERX}:{get_latest_model_version(WHISPERX)}",
-                input={
-                    "audio_file": audio,
-                    "diarization": diarization,
-                    "huggingface_access_token": hf_access_token,
-                },
+            transcript = Transcript.from_dict(result["transcription"])
+            if transcript.text is not None:
+                st.markdown(transcript.text.replace("$", r"\$"))
+                continue
+            lines = [
+                f"**{convert_to_minutes(s.start)} - {s.speaker}:** "
+                + s.text.replace("$", r"\$")
+                for s in transcript.segments
+            ]
+            st.markdown("\n\n".join(lines))
+
+
+def export_data(record: JobRecord, fmt: str) -> Callable[[], bytes]:
+    # Written on the first click into the job workdir, from the saved result
+    def data() -> bytes:
+        path = Path(record.workdir) / f"transcript.{fmt}"
+        if not path.exists():
+            partial = path.with_name(f"{path.name}.tmp")
+            export.write(partial, fmt, export.result(record.state))
+            partial.replace(path)
+        return path.read_bytes()
+
+    return data
+
+
+def render_exports(record: JobRecord) -> None:
+    transcript = Transcript.from_dict(record.state["transcription"])
+    formats = [
+        fmt
+        for fmt in export.FORMATS
+        if transcript.text is None or fmt not in export.TIMED_FORMATS
+    ]
+    for column, fmt in zip(st.columns(len(formats)), formats, strict=True):
+        with column:
+            st.download_button(
+                label=fmt.upper(),
+                data=export_data(record, fmt),
+                file_name=f"transcript.{fmt}",
+                mime=export.MIME_TYPES[fmt],
+                on_click="ignore",
+                icon=":material/download:",
             )
-        except httpx.ReadTimeout:
-            transcription = get_latest_prediction_output()
-        except:  # noqa: E722
-            st.error("Model error 😫 Try to switch the model 👍", icon="🚨")
-            st.stop()
-
-        transcription = {
-            "num_speakers": detected_num_speakers(transcription, model=WHISPERX)
-            if diarization
-            else 1,
-            "segments": cast("dict[str, Any]", transcription)["segments"],
-        }
-        return transcription  # noqa: RET504
-
-
-def transcribe(model_name: str = st.session_state.model_name) -> dict[str, Any] | None:
-    if model_name == WHISPER_DIARIZATION:
-        return process_whisper_diarization()
-    if model_name == INCREDIBLY_FAST_WHISPER:
-        return process_incredibly_fast_whisper()
-    if model_name == OPENAI:
-        return process_openai()
-    if model_name == WHISPERX:
-        return process_whisperx()
-    return None
-
-
-@st.cache_data(show_spinner=False)
-def translate(
-    text: str,
-    target_language: str | None = st.session_state.language,
-    chunks: bool = False,
-    sleep_time: int = 30,
-) -> str:
-    if target_language is None:
-        return text
-    prompt = f"Translate input text to {target_language}. Return only translated text: <input_text>{text}</input_text>"
-    try:
-        translation = gemini_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=dedent("""
-                    You are a language model specializing in accurate, context-sensitive translations.
-                    Translate each text with precise meaning and maintain the original tone and style.
-                    Adapt idioms, cultural references, and metaphors for naturalness in the target language,
-                    while providing brief explanations directly in the text, if necessary.
-                    Avoid literal translations unless they are essential.
-                    When terms have multiple meanings, use the context to select the best fit.
-                    Do not translate proper nouns or technical terms unless widely recognized equivalents exist.
-                    Ensure consistent terminology, especially for technical or specialized language.
-                    Use polite, respectful language, adjusting formality as appropriate for the text type (e.g., legal, business, casual).
-                    I want you to only reply the translation, do not write notes or explanations.
-                    """).strip(),
-                response_mime_type="text/plain",
-                thinking_config=THINKING_CONFIG,
-            ),
+
+
+def render_results(record: JobRecord) -> None:
+    options = JobOptions.model_validate(record.options)
+    state = record.state
+    converted_file = Job(id=record.id, workdir=Path(record.workdir)).converted_file
+    if converted_file.exists() and "download" in state.get("completed", []):
+        st.audio(str(converted_file))
+    if trimmed := state.get("trimmed"):
+        saved = trimmed["audio_seconds"] - trimmed["trimmed_seconds"]
+        st.caption(
+            f"Transcribed {trimmed['trimmed_seconds'] / 60:.1f} of "
+            f"{trimmed['audio_seconds'] / 60:.1f} minutes, "
+            f"{saved / 60:.1f} minutes saved",
         )
-        if chunks:
-            time.sleep(
-                sleep_time,
-            )  # 2 queries per minute for Gemini-1.5-pro and 15 for Gemini-1.5-flash https://ai.google.dev/gemini-api/docs/models/gemini#model-variations
-    except ValueError:
-        st.error(
-            "The translator thinks the content is unsafe and can't return the translation 🙈",
-            icon="🚨",
+    if comparison := state.get("comparison"):
+        render_comparison(comparison)
+        return
+    if "transcription" not in state:
+        return
+    if not options.streaming and record.status not in FINAL_STATUSES:
+        return
+    transcript = Transcript.from_dict(state["transcription"])
+    if transcript.text is not None:
+        # for incredibly-fast-whisper (without diarization) and openai/whisper
+        render_text(state, options)
+    elif "speakers" in state["completed"]:
+        render_segments(transcript, state, options)
+    if record.status == DONE:
+        render_exports(record)
+    if st.session_state.raw_json and state.get("raw_outputs"):
+        outputs = state["raw_outputs"]
+        st.download_button(
+            label="Download JSON",
+            data=json.dumps(outputs[0] if len(outputs) == 1 else outputs),
+            file_name="data.json",
+            mime="application/json",
         )
-        st.stop()
-    else:
-        if translation.text is not None:
-            return translation.text
-        return text
 
 
-@st.cache_data(show_spinner=False)
-def identify_speakers(transcription: dict[str, Any]) -> dict[str, str]:
-    prompt = (
-        f'Identify speaker names from context and map each "SPEAKER_XX" label to the identified name in this json <transcribed_json>{transcription}</transcribed_json>. '
-        'If a speaker cannot be identified, return their original label as the detected name (e.g. original_speaker="SPEAKER_00", detected_speaker="SPEAKER_00"). '
-        "Return one entry per unique speaker."
-    )
-    names = gemini_client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            system_instruction=None,
-            response_mime_type="application/json",
-            response_schema=list[SpeakerMapping],
-            thinking_config=types.ThinkingConfig(
-                thinking_level=types.ThinkingLevel.HIGH,
-            ),
-        ),
+def render_job(job_id: str) -> None:
+    record = get_store().get(job_id)
+    if record is None:
+        st.error("The job is not found. Results are kept for a limited time.")
+        return
+    if record.status == QUEUED:
+        st.info("Waiting for a free worker...", icon="⏳")
+    elif record.status not in FINAL_STATUSES:
+        st.info(STAGE_MESSAGES.get(record.stage or "", "Processing..."), icon="⏳")
+    render_results(record)
+    if record.status == FAILED:
+        st.error(record.error or "Repeat attempt! An error has occurred.", icon="🚨")
+    if record.status in FINAL_STATUSES and st.session_state.get("polling"):
+        st.rerun()  # stop polling
+
+
+def show_job(job_id: str) -> None:
+    record = get_store().get(job_id)
+    st.session_state.polling = (
+        record is not None and record.status not in FINAL_STATUSES
     )
-    segments = cast("list[dict[str, Any]]", transcription["segments"])
-    defaults = {seg["speaker"]: seg["speaker"] for seg in segments}
-    parsed = cast("list[SpeakerMapping] | None", names.parsed)
-    if not parsed:
-        st.error("Can't identify speakers 🙈", icon="🚨")
-        st.stop()
-    return {**defaults, **{m.original_speaker: m.detected_speaker for m in parsed}}
-
-
-@st.cache_data(show_spinner=False)
-def convert_to_minutes(seconds: float | str) -> str:
-    minutes, seconds = divmod(float(seconds), 60)
-    return f"{int(minutes)}:{int(seconds):02d}"
-
-
-def clean_up() -> None:
-    if Path(CONVERTED_FILE_NAME).is_file():
-        Path(CONVERTED_FILE_NAME).unlink()
-    if Path(AUDIO_FILE_NAME).is_file():
-        Path(AUDIO_FILE_NAME).unlink()
-
-
-def process_transcription() -> None:
-    with st.spinner("Compressing file..."):
-        compress_audio()
-    st.audio(CONVERTED_FILE_NAME)
-    with st.spinner("Transcribing..."):
-        transcription = transcribe(model_name=st.session_state.model_name)
-        if transcription is None:
-            return
-        if transcription["num_speakers"] == 1:
-            for segment in transcription["segments"]:
-                text = str(segment["text"]).replace("$", r"\$")
-                st.markdown(
-                    f"**{convert_to_minutes(segment['start'])}:** {translate(text, chunks=True, sleep_time=5)}",
-                )
-        elif (
-            transcription["num_speakers"] == 0
-        ):  # for incredibly-fast-whisper (without diarization) and openai/whisper
-            st.markdown(translate(transcription["segments"]).replace("$", r"\$"))
-        else:
-            if st.session_state.speaker_identification:
-                names = identify_speakers(transcription)
-            else:
-                names = {}
-                for speaker in transcription["segments"]:
-                    names[speaker["speaker"]] = speaker["speaker"]
-            for segment in transcription["segments"]:
-                text = str(segment["text"]).replace("$", r"\$")
-                st.markdown(
-                    f"**{convert_to_minutes(segment['start'])} - {names.get(segment['speaker'], segment['speaker'])}:** {translate(text, chunks=True, sleep_time=5)}",
-                )
-        if st.session_state.raw_json:
-            last_prediction_id = replicate_client.predictions.list().results[0].id
-            data = json.dumps(
-                replicate_client.predictions.get(last_prediction_id).output,
-            )
-            st.download_button(
-                label="Download JSON",
-                data=data,
-                file_name="data.json",
-                mime="application/json",
-            )
+    if st.session_state.polling:
+        get_worker()  # resumes jobs left by a restart
+    run_every = POLL_INTERVAL_SECONDS if st.session_state.polling else None
+    st.fragment(run_every=run_every)(render_job)(job_id)
 
 
 # Frontend
@@ -477,18 +316,18 @@ st.title("Transcribe & Translate Audio Files")
 
 st.radio(
     label="Choose what to transcribe:",
-    options=["Uploaded file", "YouTube or link to an audio file"],
+    options=[UPLOAD_MODE, LINK_MODE],
     key="mode",
 )
 
 data_input: UploadedFile | str | None = None
-if st.session_state.mode == "Uploaded file":
+if st.session_state.mode == UPLOAD_MODE:
     data_input = st.file_uploader(
         "Choose a file:",
         # https://cloud.google.com/vertex-ai/generative-ai/docs/multimodal/audio-understanding#audio-requirements
         type=["wav", "mp3", "aiff", "aac", "ogg", "flac", "m4a", "mp4", "mov"],
     )
-if st.session_state.mode == "YouTube or link to an audio file":
+if st.session_state.mode == LINK_MODE:
     data_input = st.text_input(
         label="Enter a YouTube URL or audio link:",
         placeholder="https://traffic.megaphone.fm/GLD4878952581.mp3",
@@ -587,10 +426,55 @@ if advanced:
             )
 
     st.checkbox("Enable Raw JSON download", key="raw_json")
+    st.checkbox("Show results as soon as they are ready", key="streaming")
+    st.checkbox("Remove long silences before transcribing", key="trim_silence")
+    st.checkbox(
+        "Compare all models side by side",
+        key="compare",
+        help="Transcribes the whole file with every model, without chunking "
+        "or post-processing",
+    )
+    st.slider(
+        "Speed up audio before transcribing",
+        min_value=1.0,
+        max_value=MAX_TEMPO,
+        step=0.05,
+        key="tempo",
+        help="Fewer billed seconds, faster speech may be transcribed less accurately",
+    )
+    st.toggle(
+        "Split long audio at silences and transcribe chunks in parallel",
+        key="chunking",
+    )
+    if st.session_state.chunking:
+        st.number_input(
+            "Chunk length, minutes",
+            min_value=5,
+            max_value=120,
+            step=5,
+            key="chunk_minutes",
+        )
     st.divider()
 
+    stats = get_cache().stats()
+    st.caption(
+        f"Transcription cache: {stats['entries']} entries, "
+        f"{stats['size'] / 1024 / 1024:.1f} MB, "
+        f"{stats['hits']} hits, {stats['misses']} misses",
+    )
+    memory = get_translation_memory().stats()
+    st.caption(
+        f"Translation memory: {memory['entries']} segments, "
+        f"{memory['size'] / 1024 / 1024:.1f} MB, "
+        f"{memory['hit_rate']:.0%} hit rate ({memory['near_hits']} near duplicates)",
+    )
+    jobs = get_store().counts()
+    st.caption(
+        f"Jobs: {jobs.get('queued', 0)} queued, {jobs.get('running', 0)} running",
+    )
     if st.button("Clear Cache", type="primary"):
-        st.cache_data.clear()
+        get_cache().clear()
+        get_translation_memory().clear()
         st.success("Cache cleared.")
     st.divider()
 
@@ -599,19 +483,21 @@ go = st.button("Go")
 # Data processing
 if go:
     try:
-        if st.session_state.mode == "Uploaded file" and data_input is None:
+        if st.session_state.mode == UPLOAD_MODE and data_input is None:
             st.error("Upload an audio file.", icon="🚨")
         elif (
-            st.session_state.mode == "YouTube or link to an audio file"
+            st.session_state.mode == LINK_MODE
             and isinstance(data_input, str)
             and not data_input.strip()
         ):
             st.error("Enter an audio file link.", icon="🚨")
-        else:
-            download(url=data_input)
-            process_transcription()
+        elif data_input is not None:
+            st.session_state.job_id = submit(data_input)
+            st.query_params["job"] = st.session_state.job_id
     except Exception as e:
+        logger.exception("Can't submit the job")
         st.error("Repeat attempt! An error has occurred.", icon="🚨")
         st.write(e)
-    finally:
-        clean_up()
+
+if st.session_state.job_id:
+    show_job(st.session_state.job_id)
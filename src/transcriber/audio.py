@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator, Sequence
+
+CHUNK_SIZE = 256 * 1024
+FFMPEG = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+TARGET_CHANNELS = 1
+TARGET_BIT_RATE = 16_000
+# Container overhead on top of the audio bit rate
+BIT_RATE_TOLERANCE = 1.1
+# Longer inputs are encoded in segments on several cores and joined
+PARALLEL_ENCODE_MIN_SECONDS = 20 * 60
+MIN_SEGMENT_SECONDS = 5 * 60
+MAX_ENCODE_WORKERS = 4
+# What the encoding planner does with an input
+SKIP = "skip"  # already what the model gets, copied as it is
+REMUX = "remux"  # the same Opus stream moved into Ogg
+TRANSCODE = "transcode"
+STREAM = "stream"  # transcoded while downloading, without probing first
+# Containers that keep their index at the end of the file can't be decoded from a pipe
+SEEKABLE_ONLY_SUFFIXES = {".mp4", ".m4a", ".mov"}
+SEEKABLE_ONLY_CONTENT_TYPES = {
+    "audio/mp4",
+    "audio/x-m4a",
+    "video/mp4",
+    "video/quicktime",
+}
+
+
+class Profile(NamedTuple):
+    # Mono Opus in Ogg, with what a model prefers
+    bit_rate: int = TARGET_BIT_RATE
+    sample_rate: int | None = None  # the input's when None
+
+    @property
+    def args(self) -> list[str]:
+        rate = [] if self.sample_rate is None else ["-ar", str(self.sample_rate)]
+        bit_rate = f"{self.bit_rate // 1000}k"
+        return ["-vn", "-ac", "1", *rate, "-c:a", "libopus", "-b:a", bit_rate]
+
+
+DEFAULT_PROFILE = Profile()
+OPUS_ARGS = DEFAULT_PROFILE.args
+
+
+class Plan(NamedTuple):
+    action: str
+    profile: Profile
+    source: dict[str, Any]  # what ffprobe found
+    segments: int = 1
+
+
+def needs_seekable_input(name: str, content_type: str | None = None) -> bool:
+    suffix = PurePosixPath(name.split("?", 1)[0]).suffix.lower()
+    mime = (content_type or "").split(";", 1)[0].strip().lower()
+    return suffix in SEEKABLE_ONLY_SUFFIXES or mime in SEEKABLE_ONLY_CONTENT_TYPES
+
+
+def encode_stream(
+    chunks: Iterable[bytes],
+    converted_file_name: Path,
+    input_args: Sequence[str] = (),
+    filter_args: Sequence[str] = (),
+    codec_args: Sequence[str] = OPUS_ARGS,
+) -> None:
+    args = [
+        *FFMPEG,
+        *input_args,
+        "-i",
+        "pipe:0",
+        *filter_args,
+        *codec_args,
+        str(converted_file_name),
+    ]
+    process = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert process.stdin is not None  # noqa: S101
+    assert process.stderr is not None  # noqa: S101
+    stderr: list[bytes] = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+    reader.start()
+    try:
+        with contextlib.suppress(BrokenPipeError):  # ffmpeg exited, see return code
+            for chunk in chunks:
+                process.stdin.write(chunk)
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            process.stdin.close()
+        returncode = process.wait()
+        reader.join()
+    if returncode:
+        raise subprocess.CalledProcessError(
+            returncode,
+            args,
+            stderr=b"".join(stderr).decode(errors="replace"),
+        )
+
+
+def probe_args(audio_file_name: Path) -> list[str]:
+    return [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=codec_name,channels,sample_rate,bit_rate:format=format_name,duration,bit_rate",
+        "-of",
+        "json",
+        str(audio_file_name),
+    ]
+
+
+def parse_probe(output: str) -> dict[str, Any]:
+    data = json.loads(output)
+    stream = data["streams"][0] if data.get("streams") else {}
+    fmt = data.get("format", {})
+    return {
+        "codec_name": stream.get("codec_name"),
+        "channels": int(stream.get("channels") or 0),
+        "sample_rate": int(stream.get("sample_rate") or 0),
+        "bit_rate": int(stream.get("bit_rate") or fmt.get("bit_rate") or 0),
+        "duration": float(fmt.get("duration") or 0),
+        "format_name": fmt.get("format_name"),
+    }
+
+
+async def run(args: Sequence[str]) -> tuple[str, str]:
+    # stdout and stderr of a process run without blocking the event loop
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except BaseException:
+        # Cancelled with the job, the process doesn't outlive it
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+        raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(
+            process.returncode,
+            list(args),
+            output=stdout.decode(errors="replace"),
+            stderr=stderr.decode(errors="replace"),
+        )
+    return stdout.decode(errors="replace"), stderr.decode(errors="replace")
+
+
+async def probe(audio_file_name: Path) -> dict[str, Any]:
+    stdout, _ = await run(probe_args(audio_file_name))
+    return parse_probe(stdout)
+
+
+def plan_encoding(
+    source: dict[str, Any],
+    profile: Profile = DEFAULT_PROFILE,
+    workers: int | None = None,
+) -> Plan:
+    # Opus is always decoded at 48 kHz, so a small mono Opus input is kept
+    # whatever sample rate the model prefers
+    if (
+        source["codec_name"] == "opus"
+        and source["channels"] == TARGET_CHANNELS
+        and 0 < source["bit_rate"] <= profile.bit_rate * BIT_RATE_TOLERANCE
+    ):
+        action = SKIP if source["format_name"] == "ogg" else REMUX
+        return Plan(action, profile, source)
+    if workers is None:
+        workers = min(os.process_cpu_count() or 1, MAX_ENCODE_WORKERS)
+    segments = 1
+    if source["duration"] >= PARALLEL_ENCODE_MIN_SECONDS:
+        segments = max(1, min(workers, int(source["duration"] // MIN_SEGMENT_SECONDS)))
+    return Plan(TRANSCODE, profile, source, segments)
+
+
+async def ffmpeg(*args: str) -> None:
+    await run([*FFMPEG, *args])
+
+
+def encode_args(
+    audio_file_name: Path,
+    converted_file_name: Path,
+    plan: Plan,
+) -> list[str]:
+    # Remuxes or transcodes the whole input in one go
+    codec_args = ["-vn", "-c:a", "copy"] if plan.action == REMUX else plan.profile.args
+    return ["-i", str(audio_file_name), *codec_args, str(converted_file_name)]
+
+
+@contextlib.contextmanager
+def segment_parts(
+    audio_file_name: Path,
+    converted_file_name: Path,
+    plan: Plan,
+) -> Iterator[tuple[list[list[str]], list[str]]]:
+    # ffmpeg arguments of every segment and of joining them, the Opus packets
+    # are joined without decoding them again
+    length = plan.source["duration"] / plan.segments
+    with tempfile.TemporaryDirectory(dir=converted_file_name.parent) as tmp:
+        workdir = Path(tmp)
+        parts = [workdir / f"part_{i:03d}.ogg" for i in range(plan.segments)]
+        concat = workdir / "parts.txt"
+        concat.write_text("".join(f"file '{part.name}'\n" for part in parts))
+        segments = [
+            [
+                "-ss",
+                f"{i * length:.3f}",
+                *(["-t", f"{length:.3f}"] if i < plan.segments - 1 else []),
+                "-i",
+                str(audio_file_name),
+                *plan.profile.args,
+                str(part),
+            ]
+            for i, part in enumerate(parts)
+        ]
+        yield (
+            segments,
+            ["-f", "concat", "-i", str(concat), "-c", "copy", str(converted_file_name)],
+        )
+
+
+async def convert_to_opus(
+    audio_file_name: Path,
+    converted_file_name: Path,
+    profile: Profile = DEFAULT_PROFILE,
+) -> Plan:
+    plan = plan_encoding(await probe(audio_file_name), profile)
+    if plan.action == SKIP:
+        await asyncio.to_thread(shutil.copyfile, audio_file_name, converted_file_name)
+    elif plan.segments > 1:
+        with segment_parts(audio_file_name, converted_file_name, plan) as (parts, join):
+            tasks = [asyncio.ensure_future(ffmpeg(*args)) for args in parts]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # The other segments are stopped before their files are removed
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            await ffmpeg(*join)
+    else:
+        await ffmpeg(*encode_args(audio_file_name, converted_file_name, plan))
+    return plan
@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import logging
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+from transcriber import metrics, settings, transcript
+from transcriber.audio import Profile
+from transcriber.errors import PipelineError
+from transcriber.predictions import (
+    create_prediction,
+    wait_for_prediction,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+    from typing import IO
+
+    from replicate.file import File
+    from replicate.prediction import Prediction
+
+    from transcriber.jobs import Job
+    from transcriber.services import Services
+    from transcriber.transcript import Transcript
+
+logger = logging.getLogger(__name__)
+
+WHISPER_DIARIZATION = "thomasmol/whisper-diarization"
+INCREDIBLY_FAST_WHISPER = "vaibhavs10/incredibly-fast-whisper"
+OPENAI = "openai/gpt-4o-transcribe"
+WHISPERX = "victor-upmeet/whisperx"
+MODELS = [WHISPER_DIARIZATION, INCREDIBLY_FAST_WHISPER, OPENAI, WHISPERX]
+# Community models are run by version, official ones by name
+VERSIONED_MODELS = [WHISPER_DIARIZATION, INCREDIBLY_FAST_WHISPER, WHISPERX]
+# Rough USD list prices: per billed second of the model's GPU for community
+# models, per audio second for official ones
+HARDWARE_PRICES = {
+    WHISPER_DIARIZATION: 0.000725,  # L40S
+    INCREDIBLY_FAST_WHISPER: 0.0014,  # A100 80 GB
+    WHISPERX: 0.000725,  # L40S
+}
+AUDIO_PRICES = {OPENAI: 0.0001}
+# Failures of these models are shown as a model error
+FLAKY_MODELS = {INCREDIBLY_FAST_WHISPER, WHISPERX}
+MODEL_ERROR = "Model error 😫 Try to switch the model 👍"
+# All of them take Ogg Opus. Whisper resamples to 16 kHz, the OpenAI model
+# works on 24 kHz audio
+PROFILES = {
+    WHISPER_DIARIZATION: Profile(sample_rate=16_000),
+    INCREDIBLY_FAST_WHISPER: Profile(sample_rate=16_000),
+    OPENAI: Profile(sample_rate=24_000),
+    WHISPERX: Profile(sample_rate=16_000),
+}
+
+
+def is_diarized(model_name: str, diarization: bool) -> bool:
+    return model_name == WHISPER_DIARIZATION or (
+        model_name in {INCREDIBLY_FAST_WHISPER, WHISPERX} and diarization
+    )
+
+
+@contextlib.contextmanager
+def prediction_span(
+    job: Job,
+    audio_file_name: Path,
+    model: str,
+    version: str | None,
+) -> Iterator[metrics.Span]:
+    with metrics.span(
+        "replicate.prediction",
+        model=model,
+        version=version,
+        bytes=0
+        if str(audio_file_name) in job.audio_urls
+        else audio_file_name.stat().st_size,
+    ) as span:
+        yield span
+
+
+def created(job: Job, span: metrics.Span, prediction: Prediction) -> None:
+    span.set(prediction_id=prediction.id)
+    job.prediction_ids.append(prediction.id)
+
+
+def finished(job: Job, span: metrics.Span, prediction: Prediction) -> None:
+    timings = prediction_timings(prediction)
+    job.billed_seconds += timings.get("billed_seconds", 0)
+    span.set(**timings)
+
+
+async def run_prediction(  # noqa: PLR0913, PLR0917
+    services: Services,
+    job: Job,
+    audio_file_name: Path,
+    model: str,
+    model_input: dict[str, Any],
+    version: str | None = None,
+) -> Any:
+    with prediction_span(job, audio_file_name, model, version) as span:
+        prediction = await create_prediction(
+            services.replicate_client,
+            model,
+            version,
+            model_input,
+            webhook=services.webhook,
+        )
+        created(job, span, prediction)
+        try:
+            waited = await wait_for_prediction(prediction, services.webhook)
+            output = waited.output
+        finally:
+            finished(job, span, prediction)
+    job.raw_outputs[str(audio_file_name)] = output
+    return output
+
+
+@contextlib.contextmanager
+def open_audio(job: Job, audio_file_name: Path) -> Iterator[IO[bytes] | str]:
+    # The client uploads open files with every prediction
+    if url := job.audio_urls.get(str(audio_file_name)):
+        yield url
+        return
+    with audio_file_name.open("rb") as audio:
+        yield audio
+
+
+async def upload_audio(services: Services, audio_file_name: Path) -> File:
+    with metrics.span("replicate.upload", bytes=audio_file_name.stat().st_size):
+        return await services.replicate_client.files.async_create(audio_file_name)
+
+
+async def delete_upload(services: Services, upload: File) -> None:
+    try:
+        await services.replicate_client.files.async_delete(upload.id)
+    except Exception:
+        logger.warning("Could not delete uploaded file %s", upload.id)
+
+
+def estimated_cost(model: str, billed_seconds: float, audio_seconds: float) -> float:
+    # Community models bill hardware time, official ones the audio length
+    if model in AUDIO_PRICES:
+        return AUDIO_PRICES[model] * audio_seconds
+    return HARDWARE_PRICES.get(model, 0) * billed_seconds
+
+
+def prediction_timings(prediction: Prediction) -> dict[str, float]:
+    # Replicate bills the prediction time, queueing is free but adds latency
+    timings: dict[str, float] = {}
+    if predict_time := (prediction.metrics or {}).get("predict_time"):
+        timings["billed_seconds"] = predict_time
+    if prediction.created_at and prediction.started_at:
+        with contextlib.suppress(ValueError):  # unexpected timestamp format
+            timings["queue_seconds"] = (
+                datetime.fromisoformat(prediction.started_at)
+                - datetime.fromisoformat(prediction.created_at)
+            ).total_seconds()
+    return timings
+
+
+def model_request(
+    services: Services,
+    model_name: str,
+    audio: IO[bytes] | str,
+    diarization: bool = True,
+) -> dict[str, Any]:
+    if model_name == WHISPER_DIARIZATION:
+        model_input: dict[str, Any] = {
+            "file": audio,
+            "transcript_output_format": "segments_only",
+        }
+    elif model_name == INCREDIBLY_FAST_WHISPER:
+        model_input = {
+            "audio": audio,
+            "hf_token": services.hf_access_token,
+            "diarise_audio": diarization,
+        }
+    elif model_name == OPENAI:
+        model_input = {"audio_file": audio}
+    elif model_name == WHISPERX:
+        model_input = {
+            "audio_file": audio,
+            "diarization": diarization,
+            "huggingface_access_token": services.hf_access_token,
+        }
+    else:
+        msg = f"Unknown model {model_name}"
+        raise PipelineError(msg)
+    return model_input
+
+
+def parse_output(model_name: str, output: Any, diarization: bool = True) -> Transcript:
+    # Undiarized models return text only, post-processing is a separate stage
+    if model_name == WHISPER_DIARIZATION:
+        return transcript.from_whisper_diarization(output)
+    if model_name == INCREDIBLY_FAST_WHISPER:
+        return transcript.from_incredibly_fast_whisper(
+            output,
+            diarization,
+            max_gap=settings.merge_gap_seconds,
+        )
+    if model_name == OPENAI:
+        return transcript.from_openai(output)
+    return transcript.from_whisperx(output, diarization)
+
+
+async def run_model(
+    services: Services,
+    job: Job,
+    model_name: str,
+    audio_file_name: Path,
+    diarization: bool = True,
+) -> Transcript:
+    # Official models run by name. Resolving a version blocks on the API
+    # the first time
+    version = (
+        await asyncio.to_thread(services.versions.resolve, model_name)
+        if model_name in VERSIONED_MODELS
+        else None
+    )
+    with open_audio(job, audio_file_name) as audio:
+        model_input = model_request(services, model_name, audio, diarization)
+        try:
+            output = await run_prediction(
+                services,
+                job,
+                audio_file_name,
+                model_name,
+                model_input,
+                version=version,
+            )
+        except Exception as e:
+            if model_name not in FLAKY_MODELS:
+                raise
+            raise PipelineError(MODEL_ERROR) from e
+    return parse_output(model_name, output, diarization)
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from transcriber import export, loop, metrics
+from transcriber.audio import probe
+from transcriber.backends import MODELS, WHISPER_DIARIZATION
+from transcriber.cache import make_key
+from transcriber.errors import PipelineError
+from transcriber.ingest import LINK_MODE, UPLOAD_MODE, feed_episodes
+from transcriber.jobs import Job, clean_up
+from transcriber.options import JobOptions
+from transcriber.pipeline import PipelineRun, run_pipeline
+from transcriber.trimming import MAX_TEMPO
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    from transcriber.services import Services
+
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE_NAME = "results.jsonl"
+FORMATS = ("srt", "vtt")  # of export.FORMATS
+UNSAFE_NAME_RE = re.compile(r"[^\w.-]+")
+# Results kept in the JSONL file besides the status of every item
+STATE_KEYS = (
+    "transcription",
+    "names",
+    "text",
+    "translation",
+    "translations",
+    "encoding",
+)
+
+
+@dataclass
+class Limits:
+    # How many items may be in each stage at once, across the whole batch
+    downloads: int = 4
+    encodes: int = 2
+    predictions: int = 4
+
+    def semaphores(self) -> dict[str, asyncio.Semaphore]:
+        return {
+            "download": asyncio.Semaphore(self.downloads),
+            "encode": asyncio.Semaphore(self.encodes),
+            "transcribe": asyncio.Semaphore(self.predictions),
+        }
+
+
+@dataclass
+class BatchReport:
+    done: int = 0
+    failed: int = 0
+    skipped: int = 0
+    audio_seconds: float = 0
+    wall_seconds: float = 0
+
+    @property
+    def audio_hours_per_hour(self) -> float:
+        return self.audio_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+
+def read_manifest(path: Path) -> list[str]:
+    # One URL or file per line, "rss <url>" adds every episode of a feed
+    sources: list[str] = []
+    for line in path.read_text().splitlines():
+        line = line.strip()  # noqa: PLW2901
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("rss "):
+            sources.extend(feed_episodes(line.removeprefix("rss ").strip()))
+        else:
+            sources.append(line)
+    return sources
+
+
+def is_local(source: str) -> bool:
+    return not source.startswith(("http://", "https://"))
+
+
+def item_key(source: str, options: JobOptions) -> str:
+    # The same source with other options is another item
+    return make_key(source, **options.model_dump(exclude={"mode", "source"}))
+
+
+def item_name(source: str, key: str) -> str:
+    stem = Path(source if is_local(source) else urlparse(source).path).stem
+    slug = UNSAFE_NAME_RE.sub("-", stem).strip("-")[:60] or "item"
+    return f"{slug}-{key[:8]}"
+
+
+def completed(output_dir: Path) -> set[str]:
+    path = output_dir / RESULTS_FILE_NAME
+    if not path.exists():
+        return set()
+    with path.open() as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    return {r["key"] for r in results if r["status"] == "done"}
+
+
+def write_outputs(
+    output_dir: Path,
+    name: str,
+    state: dict[str, Any],
+    formats: Sequence[str],
+) -> list[str]:
+    exported = export.result(state)
+    if exported.transcript.text is not None:
+        # Undiarized text has no timestamps to make subtitles from
+        formats = [f for f in formats if f not in export.TIMED_FORMATS] or ["txt"]
+    files = []
+    for fmt in formats:
+        path = output_dir / f"{name}.{fmt}"
+        export.write(path, fmt, exported)
+        files.append(path.name)
+    return files
+
+
+def item_options(job: Job, source: str, options: JobOptions) -> JobOptions:
+    if not is_local(source):
+        return options.model_copy(update={"mode": LINK_MODE, "source": source})
+    path = Path(source)
+    if not path.is_file():
+        msg = f"File not found: {source}"
+        raise PipelineError(msg)
+    # Linked into the job workdir, where the pipeline expects uploads
+    upload = job.workdir / ("upload" + path.suffix.lower())
+    upload.symlink_to(path.resolve())
+    return options.model_copy(update={"mode": UPLOAD_MODE, "source": upload.name})
+
+
+async def discard(stage: str, state: dict[str, Any]) -> None:
+    # Items aren't resumed, their state is only written with the result
+    pass
+
+
+async def process(  # noqa: PLR0913, PLR0917
+    services: Services,
+    source: str,
+    options: JobOptions,
+    output_dir: Path,
+    formats: Sequence[str],
+    semaphores: dict[str, asyncio.Semaphore],
+) -> dict[str, Any]:
+    key = item_key(source, options)
+    job = Job.create(output_dir / ".work")
+    # Local files are only encoded in the download stage, under the encodes
+    limits = {"trim": semaphores["encode"], "transcribe": semaphores["transcribe"]}
+    if not is_local(source):
+        limits["download"] = semaphores["download"]
+    state: dict[str, Any] = {}
+    result: dict[str, Any] = {"source": source, "key": key, "error": None}
+    token = metrics.job_id.set(job.id)
+    started = time.perf_counter()
+    try:
+        options = item_options(job, source, options)
+        with metrics.span("job", model=options.model_name):
+            run = PipelineRun(
+                services,
+                job,
+                options,
+                state,
+                discard,
+                encodes=semaphores["encode"],
+            )
+            await run_pipeline(run, limits)
+        result["audio_seconds"] = (await probe(job.converted_file))["duration"]
+        name = item_name(source, key)
+        result["files"] = await asyncio.to_thread(
+            write_outputs,
+            output_dir,
+            name,
+            state,
+            formats,
+        )
+        result["status"] = "done"
+    except PipelineError as e:
+        result.update(status="failed", error=str(e))
+    except Exception as e:
+        logger.exception("%s failed", source)
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        metrics.job_id.reset(token)
+        clean_up(job)
+    result["wall_seconds"] = round(time.perf_counter() - started, 3)
+    result.update((k, state[k]) for k in STATE_KEYS if k in state)
+    return result
+
+
+def run_batch(  # noqa: PLR0913
+    services: Services,
+    sources: Iterable[str],
+    options: JobOptions,
+    output_dir: Path,
+    *,
+    limits: Limits | None = None,
+    formats: Sequence[str] = FORMATS,
+    max_jobs: int = 8,
+) -> BatchReport:
+    # Items already done with the same options are skipped, failed ones rerun
+    output_dir.mkdir(parents=True, exist_ok=True)
+    done = completed(output_dir)
+    report = BatchReport()
+    pending: dict[str, str] = {}
+    for source in sources:
+        key = item_key(source, options)
+        if key in done:
+            report.skipped += 1
+        else:
+            pending.setdefault(key, source)
+    semaphores = (limits or Limits()).semaphores()
+    jobs = asyncio.Semaphore(max_jobs)
+
+    async def run(source: str) -> None:
+        # Items are tasks of the shared I/O loop, max_jobs of them at a time
+        async with jobs:
+            result = await process(
+                services,
+                source,
+                options,
+                output_dir,
+                formats,
+                semaphores,
+            )
+        with (output_dir / RESULTS_FILE_NAME).open("a") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            if result["status"] == "done":
+                report.done += 1
+                report.audio_seconds += result["audio_seconds"]
+            else:
+                report.failed += 1
+        logger.info("%s %s in %.1fs", result["status"], source, result["wall_seconds"])
+
+    async def run_all() -> None:
+        await asyncio.gather(*(run(source) for source in pending.values()))
+
+    started = time.perf_counter()
+    loop.run(run_all())
+    report.wall_seconds = time.perf_counter() - started
+    with contextlib.suppress(OSError):  # left when another batch is running
+        (output_dir / ".work").rmdir()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Transcribe many URLs, files or podcast feeds without the UI.",
+    )
+    parser.add_argument("sources", nargs="*", help="URLs or audio files")
+    parser.add_argument("-m", "--manifest", type=Path, action="append", default=[])
+    parser.add_argument("--rss", action="append", default=[], help="podcast feed")
+    parser.add_argument("-o", "--output", type=Path, default=Path("transcripts"))
+    parser.add_argument("--model", choices=MODELS, default=WHISPER_DIARIZATION)
+    parser.add_argument("--language", help="translate to it")
+    parser.add_argument("--no-diarization", dest="diarization", action="store_false")
+    parser.add_argument(
+        "--no-post-processing",
+        dest="post_processing",
+        action="store_false",
+    )
+    parser.add_argument(
+        "--no-speaker-identification",
+        dest="speaker_identification",
+        action="store_false",
+    )
+    parser.add_argument("--chunking", action="store_true")
+    parser.add_argument("--chunk-minutes", type=int, default=20)
+    parser.add_argument("--trim-silence", action="store_true")
+    parser.add_argument("--tempo", type=float, default=1.0, help=f"up to {MAX_TEMPO}")
+    parser.add_argument(
+        "--formats",
+        default=",".join(FORMATS),
+        help=f"of {', '.join(export.FORMATS)}",
+    )
+    parser.add_argument("--jobs", type=int, default=8, help="items at once")
+    parser.add_argument("--downloads", type=int, default=Limits.downloads)
+    parser.add_argument("--encodes", type=int, default=Limits.encodes)
+    parser.add_argument("--predictions", type=int, default=Limits.predictions)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sources = list(args.sources)
+    for manifest in args.manifest:
+        sources.extend(read_manifest(manifest))
+    for feed in args.rss:
+        sources.extend(feed_episodes(feed))
+    if not sources:
+        parser.error("nothing to transcribe")
+    formats = [f for f in args.formats.split(",") if f]
+    if unknown := set(formats) - set(export.FORMATS):
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    from transcriber.services import Services
+
+    report = run_batch(
+        Services.from_env(),
+        sources,
+        JobOptions(
+            mode=LINK_MODE,
+            source="",
+            model_name=args.model,
+            language=args.language,
+            diarization=args.diarization,
+            post_processing=args.post_processing,
+            speaker_identification=args.speaker_identification,
+            chunking=args.chunking,
+            chunk_minutes=args.chunk_minutes,
+            streaming=False,
+            trim_silence=args.trim_silence,
+            tempo=args.tempo,
+        ),
+        args.output,
+        limits=Limits(args.downloads, args.encodes, args.predictions),
+        formats=formats,
+        max_jobs=args.jobs,
+    )
+    sys.stdout.write(
+        f"{report.done} done, {report.failed} failed, {report.skipped} skipped: "
+        f"{report.audio_seconds / 3600:.2f} audio hours in "
+        f"{report.wall_seconds / 3600:.2f} hours, "
+        f"{report.audio_hours_per_hour:.1f} audio hours per hour\n",
+    )
+    if report.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+from typing import TYPE_CHECKING, Any
+
+from transcriber import settings
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+def file_digest(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def make_key(*parts: Any, **options: Any) -> str:
+    payload = json.dumps([parts, options], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class TranscriptionCache:
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)",
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO stats VALUES (?, 0)",
+                [("hits",), ("misses",)],
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Any | None:
+        with self._lock, closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT value FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            counter = "misses" if row is None else "hits"
+            db.execute(
+                "UPDATE stats SET value = value + 1 WHERE name = ?",
+                (counter,),
+            )
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, value: Any) -> None:
+        blob = zlib.compress(json.dumps(value).encode())
+        with self._lock, closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            (total,) = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries",
+            ).fetchone()
+            for old_key, size in db.execute(
+                "SELECT key, size FROM entries ORDER BY accessed",
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                total -= size
+
+    def stats(self) -> dict[str, int]:
+        with closing(self._connect()) as db:
+            stats = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            stats["entries"], stats["size"] = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries",
+            ).fetchone()
+        return stats
+
+    def clear(self) -> None:
+        with self._lock, closing(self._connect()) as db, db:
+            db.execute("DELETE FROM entries")
+            db.execute("UPDATE stats SET value = 0")
+
+
+def transcription_cache() -> TranscriptionCache:
+    return TranscriptionCache(
+        settings.cache_dir / "transcriptions.sqlite3",
+        max_bytes=settings.cache_max_size_mb * 1024 * 1024,
+    )
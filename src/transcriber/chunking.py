@@ -0,0 +1,245 @@
+import asyncio
+import itertools
+import logging
+import re
+import sys
+from collections import defaultdict
+from typing import TYPE_CHECKING, NamedTuple, cast
+
+from transcriber import metrics
+from transcriber.audio import ffmpeg, run
+from transcriber.transcript import Segment, Transcript, count_speakers
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+    from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+SILENCE_RE = re.compile(r"silence_(start|end): (-?\d+(?:\.\d+)?)")
+
+
+class Chunk(NamedTuple):
+    path: Path
+    offset: float  # where the chunk starts in the original audio
+    keep_from: float  # segments starting earlier belong to the previous chunk
+
+
+def silence_args(
+    audio_file_name: Path,
+    noise_db: int = -35,
+    min_silence: float = 0.5,
+) -> list[str]:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostats",
+        "-i",
+        str(audio_file_name),
+        "-af",
+        f"silencedetect=noise={noise_db}dB:d={min_silence}",
+        "-f",
+        "null",
+        "-",
+    ]
+
+
+def parse_silences(stderr: str) -> tuple[float, list[tuple[float, float]]]:
+    duration = 0.0
+    if match := DURATION_RE.search(stderr):
+        hours, minutes, seconds = match.groups()
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    silences: list[tuple[float, float]] = []
+    start: float | None = None
+    for kind, value in SILENCE_RE.findall(stderr):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    if start is not None:
+        silences.append((start, duration))
+    return duration, silences
+
+
+async def detect_silences(
+    audio_file_name: Path,
+    noise_db: int = -35,
+    min_silence: float = 0.5,
+) -> tuple[float, list[tuple[float, float]]]:
+    _, stderr = await run(silence_args(audio_file_name, noise_db, min_silence))
+    return parse_silences(stderr)
+
+
+def plan_cuts(
+    duration: float,
+    silences: Sequence[tuple[float, float]],
+    chunk_seconds: float,
+    search_window: float = 60,
+) -> list[float]:
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts: list[float] = []
+    target = chunk_seconds
+    while target < duration - chunk_seconds / 4:  # don't leave a tiny tail chunk
+        candidates = [m for m in midpoints if abs(m - target) <= search_window]
+        cut = min(candidates, key=lambda m: abs(m - target)) if candidates else target
+        cuts.append(cut)
+        target = cut + chunk_seconds
+    return cuts
+
+
+def plan_chunks(  # noqa: PLR0913, PLR0917
+    audio_file_name: Path,
+    output_dir: Path,
+    duration: float,
+    silences: Sequence[tuple[float, float]],
+    chunk_seconds: float,
+    overlap: float = 0,
+) -> list[tuple[Chunk, list[str]]]:
+    # Every chunk with the ffmpeg arguments that cut it
+    cuts = plan_cuts(duration, silences, chunk_seconds)
+    if not cuts:
+        return [(Chunk(audio_file_name, 0.0, 0.0), [])]
+    boundaries = [0.0, *cuts, duration]
+    chunks: list[tuple[Chunk, list[str]]] = []
+    for i, (keep_from, end) in enumerate(itertools.pairwise(boundaries)):
+        offset = max(0.0, keep_from - overlap) if i else 0.0
+        path = output_dir / f"chunk_{i:03d}{audio_file_name.suffix}"
+        args = [
+            "-ss",
+            f"{offset:.3f}",
+            "-to",
+            f"{end:.3f}",
+            "-i",
+            str(audio_file_name),
+            "-c",
+            "copy",
+            str(path),
+        ]
+        chunks.append((Chunk(path, offset, keep_from), args))
+    return chunks
+
+
+async def split_audio(
+    audio_file_name: Path,
+    output_dir: Path,
+    chunk_seconds: float,
+    overlap: float = 0,
+) -> list[Chunk]:
+    # Chunks are copied, not encoded, so they are all cut at once
+    duration, silences = await detect_silences(audio_file_name)
+    planned = plan_chunks(
+        audio_file_name,
+        output_dir,
+        duration,
+        silences,
+        chunk_seconds,
+        overlap,
+    )
+    await asyncio.gather(*(ffmpeg(*args) for _, args in planned if args))
+    return [chunk for chunk, _ in planned]
+
+
+async def run_chunks[T](
+    chunks: Sequence[Chunk],
+    transcribe: Callable[[Chunk], Awaitable[T]],
+    max_workers: int = 4,
+    retries: int = 2,
+) -> AsyncIterator[tuple[int, T]]:
+    # (index, result) pairs as the chunks are done, through a queue the
+    # chunk tasks put their results into
+    slots = asyncio.Semaphore(max_workers)
+    done: asyncio.Queue[tuple[int, T] | BaseException] = asyncio.Queue(max_workers)
+
+    async def attempt(i: int, chunk: Chunk) -> None:
+        async with slots:
+            for n in range(retries + 1):
+                try:
+                    await done.put((i, await transcribe(chunk)))
+                except Exception as e:
+                    if n == retries:
+                        await done.put(e)
+                        return
+                    metrics.count("retries")
+                    logger.warning("Retrying %s (attempt %d)", chunk.path.name, n + 2)
+                else:
+                    return
+
+    tasks = [asyncio.create_task(attempt(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        for _ in chunks:
+            result = await done.get()
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def match_speakers(
+    previous: Sequence[Segment],
+    current: Sequence[Segment],
+    window: tuple[float, float],
+) -> dict[str, str]:
+    overlap: dict[tuple[str, str], float] = defaultdict(float)
+    for a in previous:
+        for b in current:
+            start = max(a.start, b.start, window[0])
+            end = min(
+                a.start if a.end is None else a.end,
+                b.start if b.end is None else b.end,
+                window[1],
+            )
+            if end > start:
+                overlap[cast("str", a.speaker), cast("str", b.speaker)] += end - start
+    mapping: dict[str, str] = {}
+    used: set[str] = set()
+    for (known, local), _ in sorted(overlap.items(), key=lambda kv: -kv[1]):
+        if local not in mapping and known not in used:
+            mapping[local] = known
+            used.add(known)
+    return mapping
+
+
+def next_speaker_label(taken: set[str]) -> str:
+    n = 0
+    while f"SPEAKER_{n:02d}" in taken:
+        n += 1
+    return f"SPEAKER_{n:02d}"
+
+
+def merge_transcriptions(
+    chunks: Sequence[Chunk],
+    transcripts: Sequence[Transcript],
+) -> Transcript:
+    if all(t.text is not None for t in transcripts):
+        return Transcript(text=" ".join(t.text.strip() for t in transcripts if t.text))
+
+    merged: list[Segment] = []
+    speakers: set[str] = set()
+    previous: list[Segment] = []
+    for i, (chunk, transcript) in enumerate(zip(chunks, transcripts, strict=True)):
+        segments = [s.shifted(chunk.offset) for s in transcript.segments]
+        labelled = [s for s in segments if s.speaker is not None]
+        if labelled:
+            mapping = match_speakers(
+                [s for s in previous if s.speaker is not None],
+                labelled,
+                window=(chunk.offset, chunk.keep_from),
+            )
+            for local in sorted({cast("str", s.speaker) for s in labelled}):
+                if local not in mapping:
+                    taken = speakers | set(mapping.values())
+                    mapping[local] = local if i == 0 else next_speaker_label(taken)
+            for segment in labelled:
+                segment.speaker = sys.intern(mapping[cast("str", segment.speaker)])
+                speakers.add(segment.speaker)
+        merged.extend(s for s in segments if s.start >= chunk.keep_from)
+        previous = segments
+
+    return Transcript(
+        merged,
+        num_speakers=count_speakers(merged) or transcripts[0].num_speakers,
+    )
@@ -0,0 +1,273 @@
+import hashlib
+import itertools
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from transcriber import metrics, settings
+from transcriber.audio import CHUNK_SIZE
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+    from pathlib import Path
+
+    from curl_cffi import requests
+
+TIMEOUT_SECONDS = 120
+# A download nobody has touched for this long can be taken over by another worker
+LEASE_SECONDS = 300
+
+_local = threading.local()
+
+
+def session() -> requests.Session:
+    # curl handles aren't thread-safe, so every thread keeps its own session
+    # and reuses its connections and TLS sessions for all of its requests
+    if (current := getattr(_local, "session", None)) is None:
+        from curl_cffi import requests
+
+        current = _local.session = requests.Session(
+            impersonate="chrome",
+            verify=True,
+            timeout=TIMEOUT_SECONDS,
+        )
+    return current
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    from curl_cffi.requests.utils import requote_uri
+
+    return session().get(requote_uri(url), **kwargs)
+
+
+class Download(NamedTuple):
+    content_type: str | None
+    chunks: Iterable[bytes]
+    file: Path | None = None  # the complete body, when it was already cached
+
+
+class Entry(NamedTuple):
+    etag: str | None
+    last_modified: str | None
+    content_type: str | None
+    size: int
+    complete: bool
+
+
+def read_file(path: Path) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+class DownloadCache:
+    # Downloaded files by resolved URL, revalidated with ETag/Last-Modified
+    # and resumed with range requests when a download was interrupted
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.owner = uuid.uuid4().hex
+        directory.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, "
+                "last_modified TEXT, content_type TEXT, size INTEGER NOT NULL, "
+                "complete INTEGER NOT NULL, accessed REAL NOT NULL, "
+                "owner TEXT, lease_until REAL)",
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS resolved ("
+                "url TEXT PRIMARY KEY, resolved TEXT NOT NULL, created REAL NOT NULL)",
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.directory / "downloads.sqlite3", timeout=30)
+
+    def resolved(self, url: str) -> str | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT resolved FROM resolved WHERE url = ?",
+                (url,),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def resolve(self, url: str, resolved: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO resolved VALUES (?, ?, ?)",
+                (url, resolved, time.time()),
+            )
+
+    def _claim(self, key: str, url: str) -> Entry | None:
+        # None when another worker is downloading the same URL right now
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR IGNORE INTO entries (key, url, size, complete, accessed) "
+                "VALUES (?, ?, 0, 0, ?)",
+                (key, url, now),
+            )
+            claimed = db.execute(
+                "UPDATE entries SET owner = ?, lease_until = ?, accessed = ? "
+                "WHERE key = ? AND (owner IS NULL OR owner = ? OR lease_until < ?) "
+                "RETURNING etag, last_modified, content_type, size, complete",
+                (self.owner, now + LEASE_SECONDS, now, key, self.owner, now),
+            ).fetchone()
+        return None if claimed is None else Entry(*claimed)
+
+    def _update(self, key: str, **values: Any) -> None:
+        values["lease_until"] = time.time() + LEASE_SECONDS
+        columns = ", ".join(f"{name} = ?" for name in values)
+        with closing(self._connect()) as db, db:
+            db.execute(
+                f"UPDATE entries SET {columns} WHERE key = ?",  # noqa: S608
+                (*values.values(), key),
+            )
+
+    def _release(self, key: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE entries SET owner = NULL, lease_until = NULL "
+                "WHERE key = ? AND owner = ?",
+                (key, self.owner),
+            )
+
+    def _evict(self) -> None:
+        # Least recently used files go first, ones being read are kept
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            (total,) = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries",
+            ).fetchone()
+            for key, size in db.execute(
+                "SELECT key, size FROM entries "
+                "WHERE owner IS NULL OR lease_until < ? ORDER BY accessed",
+                (now,),
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                (self.directory / key).unlink(missing_ok=True)
+                total -= size
+
+    def _store(
+        self,
+        key: str,
+        response: requests.Response,
+        position: int,
+    ) -> Iterator[bytes]:
+        # Every chunk is on disk before it is passed on, so an interrupted
+        # download resumes from the last one
+        path = self.directory / key
+        renewed = time.monotonic()
+        complete = False
+        try:
+            with path.open("r+b" if position else "wb") as f:
+                f.truncate(position)
+                f.seek(position)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    position += len(chunk)
+                    if time.monotonic() - renewed > LEASE_SECONDS / 3:
+                        self._update(key, size=position)  # keeps the lease
+                        renewed = time.monotonic()
+                    yield chunk
+            complete = True
+        finally:
+            self._update(key, size=position, complete=int(complete))
+        self._evict()
+
+    def _request(self, key: str, url: str, entry: Entry) -> requests.Response:
+        path = self.directory / key
+        size = path.stat().st_size if path.exists() else 0
+        validator = entry.etag or entry.last_modified
+        headers = {}
+        if entry.complete and size == entry.size and validator:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        elif size and validator:
+            headers |= {"Range": f"bytes={size}-", "If-Range": validator}
+        response = get(url, headers=headers, stream=True)
+        if response.status_code == 416:  # noqa: PLR2004
+            # The partial file is already the whole body or something else
+            response.close()
+            response = get(url, stream=True)
+        return response
+
+    @contextmanager
+    def open(self, url: str) -> Iterator[Download]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        entry = self._claim(key, url)
+        if entry is None:
+            with open_uncached(url) as download:
+                yield download
+            return
+        try:
+            response = self._request(key, url, entry)
+            try:
+                yield self._download(key, entry, response)
+            finally:
+                response.close()
+        finally:
+            self._release(key)
+
+    def _download(
+        self,
+        key: str,
+        entry: Entry,
+        response: requests.Response,
+    ) -> Download:
+        path = self.directory / key
+        with metrics.span("download.cache") as span:
+            if response.status_code == 304:  # noqa: PLR2004
+                span.set(cache_hits=1)
+                return Download(entry.content_type, read_file(path), path)
+            response.raise_for_status()
+            span.set(cache_misses=1)
+            position = 0
+            if response.status_code == 206:  # noqa: PLR2004
+                position = path.stat().st_size
+                span.set(resumed_bytes=position)
+            content_type = response.headers.get("Content-Type")
+            self._update(
+                key,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                content_type=content_type,
+                size=position,
+                complete=0,
+            )
+        chunks = self._store(key, response, position)
+        if position:
+            # The part downloaded before is read before the rest is appended
+            return Download(content_type, itertools.chain(read_file(path), chunks))
+        return Download(content_type, chunks)
+
+
+@contextmanager
+def open_uncached(url: str) -> Iterator[Download]:
+    response = get(url, stream=True)
+    try:
+        response.raise_for_status()
+        yield Download(
+            response.headers.get("Content-Type"),
+            response.iter_content(chunk_size=CHUNK_SIZE),
+        )
+    finally:
+        response.close()
+
+
+def download_cache() -> DownloadCache | None:
+    if not settings.download_cache_max_size_mb:
+        return None
+    return DownloadCache(
+        settings.cache_dir / "downloads",
+        max_bytes=settings.download_cache_max_size_mb * 1024 * 1024,
+    )
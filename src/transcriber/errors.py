@@ -0,0 +1,3 @@
+class PipelineError(Exception):
+    # The message is shown to the user as is
+    pass
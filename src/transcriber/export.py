@@ -0,0 +1,188 @@
+import json
+import re
+import zipfile
+from typing import TYPE_CHECKING, Any, NamedTuple
+from xml.sax.saxutils import escape
+
+from transcriber.transcript import Transcript
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+    from pathlib import Path
+    from typing import BinaryIO
+
+# Characters XML 1.0 doesn't allow, dropped from DOCX text
+INVALID_XML_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+DOCX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+        "</Relationships>"
+    ),
+}
+DOCX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    "<w:body>"
+)
+DOCX_FOOTER = "</w:body></w:document>"
+
+
+class Cue(NamedTuple):
+    start: float
+    end: float
+    speaker: str | None  # the identified name when there is one
+    text: str
+
+
+class Result(NamedTuple):
+    transcript: Transcript
+    names: Mapping[str, str] | None
+    texts: Sequence[str | None] | None
+
+
+def result(state: Mapping[str, Any]) -> Result:
+    # What the job shows: corrected or translated text, named speakers
+    transcript = Transcript.from_dict(state["transcription"])
+    if transcript.text is not None:
+        text = state.get("translation") or state.get("text") or transcript.text
+        return Result(Transcript(text=text), None, None)
+    return Result(transcript, state.get("names"), state.get("translations"))
+
+
+def timestamp(seconds: float, separator: str = ",") -> str:
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def cues(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[Cue]:
+    # Translated texts replace the segment texts, speakers get their names
+    segments = transcript.segments
+    for i, segment in enumerate(segments):
+        text = segment.text if texts is None else texts[i]
+        if text is None:
+            continue
+        end = segment.end
+        if end is None:  # open segments last until the next one
+            end = segments[i + 1].start if i + 1 < len(segments) else segment.start
+        name = segment.speaker
+        if name is not None:
+            name = (names or {}).get(name, name)
+        yield Cue(segment.start, max(end, segment.start), name, text.strip())
+
+
+def label(cue: Cue) -> str:
+    return cue.text if cue.speaker is None else f"{cue.speaker}: {cue.text}"
+
+
+def srt(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[str]:
+    for i, cue in enumerate(cues(transcript, names, texts), 1):
+        yield f"{i}\n{timestamp(cue.start)} --> {timestamp(cue.end)}\n{label(cue)}\n\n"
+
+
+def vtt(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[str]:
+    yield "WEBVTT\n\n"
+    for cue in cues(transcript, names, texts):
+        yield f"{timestamp(cue.start, '.')} --> {timestamp(cue.end, '.')}\n"
+        yield f"{label(cue)}\n\n"
+
+
+def jsonl(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[str]:
+    if transcript.text is not None:
+        yield json.dumps({"text": transcript.text}, ensure_ascii=False) + "\n"
+    for cue in cues(transcript, names, texts):
+        yield json.dumps(cue._asdict(), ensure_ascii=False) + "\n"
+
+
+def paragraphs(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[str]:
+    if transcript.text is not None:
+        yield from (p.strip() for p in transcript.text.split("\n\n") if p.strip())
+    for cue in cues(transcript, names, texts):
+        yield f"[{timestamp(cue.start).split(',')[0]}] {label(cue)}"
+
+
+def txt(
+    transcript: Transcript,
+    names: Mapping[str, str] | None = None,
+    texts: Sequence[str | None] | None = None,
+) -> Iterator[str]:
+    for paragraph in paragraphs(transcript, names, texts):
+        yield paragraph + "\n\n"
+
+
+def write_docx(lines: Iterable[str], file: BinaryIO) -> None:
+    # A minimal WordprocessingML package, one paragraph per line, written as
+    # the lines come
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED) as package:
+        for name, xml in DOCX_PARTS.items():
+            package.writestr(name, xml)
+        with package.open("word/document.xml", "w") as document:
+            document.write(DOCX_HEADER.encode())
+            for line in lines:
+                for part in line.split("\n"):
+                    text = escape(INVALID_XML_RE.sub("", part))
+                    document.write(
+                        f'<w:p><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'.encode(),
+                    )
+            document.write(DOCX_FOOTER.encode())
+
+
+TEXT_FORMATS: dict[str, Callable[..., Iterator[str]]] = {
+    "srt": srt,
+    "vtt": vtt,
+    "jsonl": jsonl,
+    "txt": txt,
+}
+FORMATS = (*TEXT_FORMATS, "docx")
+# Subtitles need timestamps, undiarized text has none
+TIMED_FORMATS = {"srt", "vtt"}
+MIME_TYPES = {
+    "srt": "application/x-subrip",
+    "vtt": "text/vtt",
+    "jsonl": "application/jsonl",
+    "txt": "text/plain",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+def write(path: Path, fmt: str, exported: Result) -> None:
+    # Written as it is generated, the document isn't built up in memory first.
+    # The app still reads the finished file whole to serve it
+    if fmt == "docx":
+        with path.open("wb") as f:
+            write_docx(paragraphs(*exported), f)
+        return
+    with path.open("w", encoding="utf-8") as f:
+        f.writelines(TEXT_FORMATS[fmt](*exported))
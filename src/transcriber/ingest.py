@@ -0,0 +1,210 @@
+import asyncio
+import contextlib
+import subprocess
+import time
+import warnings
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from transcriber import loop, metrics
+from transcriber.audio import (
+    DEFAULT_PROFILE,
+    STREAM,
+    convert_to_opus,
+    encode_stream,
+    needs_seekable_input,
+    probe,
+)
+from transcriber.downloads import get, open_uncached
+from transcriber.errors import PipelineError
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from transcriber.audio import Plan, Profile
+    from transcriber.downloads import DownloadCache
+    from transcriber.jobs import Job
+
+UPLOAD_MODE = "Uploaded file"
+LINK_MODE = "YouTube or link to an audio file"
+
+
+async def download(  # noqa: PLR0913, PLR0917
+    job: Job,
+    mode: str,
+    source: str,
+    proxy: str | None = None,
+    downloads: DownloadCache | None = None,
+    profile: Profile = DEFAULT_PROFILE,
+    encodes: asyncio.Semaphore | None = None,
+) -> dict[str, Any]:
+    # Leaves the compressed audio in job.converted_file, returns how it was
+    # encoded. Encoding waits for one of the encodes when they are limited
+    if mode == UPLOAD_MODE:
+        # The UI saves the upload into the job workdir, source is the file name
+        encoding = await compress(job, job.workdir / source, profile, encodes)
+    else:
+        # yt-dlp, curl and the download cache's leases are synchronous, links
+        # are fetched in the event loop's shared thread pool
+        encoding = await asyncio.to_thread(
+            fetch,
+            job,
+            source,
+            proxy,
+            downloads,
+            profile,
+            encodes,
+        )
+    metrics.annotate(
+        audio_seconds=(await probe(job.converted_file))["duration"],
+        compressed_bytes=job.converted_file.stat().st_size,
+    )
+    return encoding
+
+
+def fetch(  # noqa: PLR0913, PLR0917
+    job: Job,
+    source: str,
+    proxy: str | None = None,
+    downloads: DownloadCache | None = None,
+    profile: Profile = DEFAULT_PROFILE,
+    encodes: asyncio.Semaphore | None = None,
+) -> dict[str, Any]:
+    if source.startswith(("https://www.youtube.com/", "https://youtu.be/")):
+        # Download clients are imported by the path that needs them
+        from yt_dlp import YoutubeDL
+
+        ydl_opts = {
+            # Native audio stream, usually Opus in WebM, converted in one step
+            "format": "worstaudio[acodec=opus]/worstaudio",
+            "outtmpl": str(job.workdir / "native.%(ext)s"),
+            "proxy": proxy,
+        }
+        with metrics.span("download.youtube") as span, YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(source, download=True)
+            native_file = Path(info["requested_downloads"][0]["filepath"])
+            span.set(bytes=native_file.stat().st_size)
+        return loop.run(compress(job, native_file, profile, encodes))
+    url = resolve_castro(source, downloads)
+    with downloads.open(url) if downloads else open_uncached(url) as body:
+        if body.file is not None:
+            # Cached and unchanged, encoded straight from the cache
+            return loop.run(compress(job, body.file, profile, encodes))
+        if needs_seekable_input(url, body.content_type):
+            with (
+                metrics.span("download.http", bytes=0) as span,
+                job.audio_file.open("wb") as f,
+            ):
+                f.writelines(counted(body.chunks, span))
+            return loop.run(compress(job, job.audio_file, profile, encodes))
+        # Encoded as fast as it downloads, so it doesn't take one of the
+        # encodes for the whole transfer. The download limit covers it
+        return compress_stream(job, body.chunks, profile)
+
+
+def counted(chunks: Iterable[bytes], span: metrics.Span) -> Iterator[bytes]:
+    for chunk in chunks:
+        span.add("bytes", len(chunk))
+        yield chunk
+
+
+def resolve_castro(url: str, downloads: DownloadCache | None = None) -> str:
+    if not url.startswith("https://castro.fm/episode/"):
+        return url
+    if downloads and (resolved := downloads.resolved(url)):
+        return resolved
+    from bs4 import BeautifulSoup
+
+    with metrics.span("download.castro"):
+        page = get(url)
+    source = BeautifulSoup(page.content, "html.parser").source
+    if source is None:
+        return url
+    src = source.get("src")
+    if not isinstance(src, str):
+        msg = "Could not extract audio URL from castro.fm page"
+        raise PipelineError(msg)
+    if downloads:
+        downloads.resolve(url, src)
+    return src
+
+
+def feed_episodes(url: str) -> list[str]:
+    # Audio enclosures of a podcast RSS feed, newest first as the feed lists them
+    from bs4 import BeautifulSoup, XMLParsedAsHTMLWarning
+
+    with metrics.span("download.feed"):
+        page = get(url)
+        page.raise_for_status()
+    with warnings.catch_warnings():
+        # Enclosure tags parse the same without an XML parser installed
+        warnings.simplefilter("ignore", XMLParsedAsHTMLWarning)
+        enclosures = BeautifulSoup(page.content, "html.parser").find_all("enclosure")
+    return [
+        src
+        for enclosure in enclosures
+        if isinstance(src := enclosure.get("url"), str)
+        and str(enclosure.get("type", "audio/")).startswith(("audio/", "video/"))
+    ]
+
+
+def encoding(
+    action: str,
+    profile: Profile,
+    seconds: float,
+    plan: Plan | None = None,
+) -> dict[str, Any]:
+    # Saved with the job, to see what the planner chose and what it cost
+    return {
+        "action": action,
+        "profile": profile._asdict(),
+        "segments": plan.segments if plan else 1,
+        "source": plan.source if plan else None,
+        "seconds": round(seconds, 3),
+    }
+
+
+async def compress(
+    job: Job,
+    audio_file_name: Path,
+    profile: Profile = DEFAULT_PROFILE,
+    encodes: asyncio.Semaphore | None = None,
+) -> dict[str, Any]:
+    if not audio_file_name.exists():
+        # Sources are removed once the job is over, a job run again has none
+        msg = "The audio file is gone, upload it again 🔄"
+        raise PipelineError(msg)
+    async with encodes or contextlib.nullcontext():
+        started = time.perf_counter()
+        try:
+            with metrics.span("compress", bytes=audio_file_name.stat().st_size) as span:
+                plan = await convert_to_opus(
+                    audio_file_name,
+                    job.converted_file,
+                    profile,
+                )
+                span.set(action=plan.action, segments=plan.segments)
+        except subprocess.CalledProcessError as e:
+            msg = f"Check uploaded file 👀\n\n{e.stderr}"
+            raise PipelineError(msg) from e
+    return encoding(plan.action, profile, time.perf_counter() - started, plan)
+
+
+def compress_stream(
+    job: Job,
+    chunks: Iterable[bytes],
+    profile: Profile = DEFAULT_PROFILE,
+) -> dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        # Downloading and encoding overlap, so they are measured together
+        with metrics.span("download.stream", bytes=0, action=STREAM) as span:
+            encode_stream(
+                counted(chunks, span),
+                job.converted_file,
+                codec_args=profile.args,
+            )
+    except subprocess.CalledProcessError as e:
+        msg = f"Check uploaded file 👀\n\n{e.stderr}"
+        raise PipelineError(msg) from e
+    return encoding(STREAM, profile, time.perf_counter() - started)
@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+AUDIO_FILE_NAME = "audio.mp3"
+CONVERTED_FILE_NAME = "audio.ogg"
+TRIMMED_FILE_NAME = "trimmed.ogg"
+
+
+@dataclass
+class Job:
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    workdir: Path = field(default=Path())
+    prediction_ids: list[str] = field(default_factory=list)
+    raw_outputs: dict[str, Any] = field(default_factory=dict)  # by audio file name
+    # Audio already uploaded to Replicate is passed to predictions by URL
+    audio_urls: dict[str, str] = field(default_factory=dict)  # by audio file name
+    billed_seconds: float = 0
+
+    @classmethod
+    def create(cls, base_dir: Path | None = None) -> Job:
+        job = cls()
+        if base_dir is not None:
+            base_dir.mkdir(parents=True, exist_ok=True)
+        job.workdir = Path(tempfile.mkdtemp(prefix=f"job-{job.id}-", dir=base_dir))
+        return job
+
+    @property
+    def audio_file(self) -> Path:
+        return self.workdir / AUDIO_FILE_NAME
+
+    @property
+    def converted_file(self) -> Path:
+        return self.workdir / CONVERTED_FILE_NAME
+
+    @property
+    def trimmed_file(self) -> Path:
+        return self.workdir / TRIMMED_FILE_NAME
+
+
+def clean_up(job: Job) -> None:
+    shutil.rmtree(job.workdir, ignore_errors=True)
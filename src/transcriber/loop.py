@@ -0,0 +1,38 @@
+import asyncio
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Coroutine
+
+_loop: asyncio.AbstractEventLoop | None = None
+_lock = threading.Lock()
+
+
+def get() -> asyncio.AbstractEventLoop:
+    # One event loop for all of the process' I/O, in its own thread. The
+    # Replicate and Gemini clients keep their async HTTP connections on it
+    global _loop  # noqa: PLW0603
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever,
+                name="io-loop",
+                daemon=True,
+            ).start()
+        return _loop
+
+
+def run[T](coro: Coroutine[object, object, T]) -> T:
+    # Runs a coroutine on the I/O loop from a thread and waits for its result
+    loop = get()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        msg = "run() waits for the I/O loop, await the coroutine on it instead"
+        raise RuntimeError(msg)
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
@@ -0,0 +1,271 @@
+import hashlib
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import TYPE_CHECKING, Any
+
+from transcriber import metrics, settings
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+    from pathlib import Path
+
+WORD_RE = re.compile(r"\w+")
+NUMBER_RE = re.compile(r"\d+")
+# Segments with the same words are translated alike, and so are segments
+# this long with at most this many differing simhash bits and the same numbers
+NEAR_MIN_CHARS = 100
+NEAR_MAX_DISTANCE = 3
+BANDS = 4  # of 16 bits, a close hash shares at least one of them
+BAND_BITS = 64 // BANDS
+SQL_VARIABLES = 500
+
+
+def source_key(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+def words_key(text: str) -> str:
+    # Case, punctuation and spacing left out
+    return hashlib.sha256(
+        " ".join(WORD_RE.findall(text.casefold())).encode(),
+    ).hexdigest()
+
+
+def simhash(text: str) -> int:
+    weights = [0] * 64
+    for word in WORD_RE.findall(text.casefold()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        value = int.from_bytes(digest)
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def bands(value: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [value >> (i * BAND_BITS) & mask for i in range(BANDS)]
+
+
+def signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def numbers(text: str) -> str:
+    return " ".join(NUMBER_RE.findall(text))
+
+
+class TranslationMemory:
+    # Translations of single segments by source text and target language,
+    # shared by all jobs and kept across restarts
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                "key TEXT PRIMARY KEY, words TEXT NOT NULL, simhash INTEGER, "
+                "numbers TEXT, band0 INTEGER, band1 INTEGER, band2 INTEGER, "
+                "band3 INTEGER)",
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS sources_words ON sources (words)")
+            for band in range(BANDS):
+                db.execute(
+                    f"CREATE INDEX IF NOT EXISTS sources_band{band} "
+                    f"ON sources (band{band})",
+                )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT NOT NULL, language TEXT NOT NULL, text TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL, "
+                "PRIMARY KEY (key, language))",
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO stats VALUES (?, 0)",
+                [("hits",), ("near_hits",), ("misses",)],
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lookup(self, texts: Sequence[str], language: str) -> dict[int, str]:
+        # Translations of the texts that have one, by index
+        language = language.strip().casefold()
+        keys = [source_key(text) for text in texts]
+        with (
+            metrics.span("translation.memory", segments=len(texts)) as span,
+            self._lock,
+            closing(self._connect()) as db,
+            db,
+        ):
+            found = select_in(
+                db,
+                "SELECT key, text FROM translations WHERE language = ? AND key",
+                language,
+                keys,
+            )
+            hits = {i: found[key][0] for i, key in enumerate(keys) if key in found}
+            near = near_matches(
+                db,
+                texts,
+                [i for i in range(len(texts)) if i not in hits],
+                language,
+            )
+            hits |= {i: translation for i, (_, translation) in near.items()}
+            # Near matches are used like exact ones, they aren't evicted first
+            used = found.keys() | {key for key, _ in near.values()}
+            now = time.time()
+            db.executemany(
+                "UPDATE translations SET accessed = ? WHERE key = ? AND language = ?",
+                [(now, key, language) for key in used],
+            )
+            counts = {
+                "hits": len(hits) - len(near),
+                "near_hits": len(near),
+                "misses": len(texts) - len(hits),
+            }
+            db.executemany(
+                "UPDATE stats SET value = value + ? WHERE name = ?",
+                [(n, name) for name, n in counts.items()],
+            )
+            span.set(cache_hits=len(hits), cache_misses=counts["misses"])
+        return hits
+
+    def store(self, translations: Iterable[tuple[str, str]], language: str) -> None:
+        # (source text, translation) pairs
+        language = language.strip().casefold()
+        sources: dict[str, tuple[str, int | None, str, list[int | None]]] = {}
+        rows: list[tuple[str, str, str, int, float]] = []
+        now = time.time()
+        for text, translation in translations:
+            key = source_key(text)
+            value = simhash(text) if len(text) >= NEAR_MIN_CHARS else None
+            sources[key] = (
+                words_key(text),
+                None if value is None else signed(value),
+                numbers(text),
+                [None] * BANDS if value is None else bands(value),
+            )
+            size = len(text.encode()) + len(translation.encode())
+            rows.append((key, language, translation, size, now))
+        if not rows:
+            return
+        with self._lock, closing(self._connect()) as db, db:
+            db.executemany(
+                "INSERT OR IGNORE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(key, *source[:3], *source[3]) for key, source in sources.items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(db)
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        (total,) = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM translations",
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, language, size in db.execute(
+            "SELECT key, language, size FROM translations ORDER BY accessed",
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute(
+                "DELETE FROM translations WHERE key = ? AND language = ?",
+                (key, language),
+            )
+            total -= size
+        db.execute(
+            "DELETE FROM sources WHERE key NOT IN (SELECT key FROM translations)",
+        )
+
+    def stats(self) -> dict[str, float]:
+        with closing(self._connect()) as db:
+            stats = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            stats["entries"], stats["size"] = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations",
+            ).fetchone()
+        lookups = stats["hits"] + stats["near_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["hits"] + stats["near_hits"]) / lookups if lookups else 0
+        )
+        return stats
+
+    def clear(self) -> None:
+        with self._lock, closing(self._connect()) as db, db:
+            db.execute("DELETE FROM translations")
+            db.execute("DELETE FROM sources")
+            db.execute("UPDATE stats SET value = 0")
+
+
+def select_in(
+    db: sqlite3.Connection,
+    query: str,
+    language: str,
+    values: Iterable[str],
+) -> dict[str, tuple[Any, ...]]:
+    # query ends with the column matched against the values, in bulk. The
+    # other columns by the first one
+    rows: dict[str, tuple[Any, ...]] = {}
+    unique = list(dict.fromkeys(values))
+    for batch in itertools.batched(unique, SQL_VARIABLES, strict=False):
+        cursor = db.execute(
+            f"{query} IN ({', '.join('?' * len(batch))})",
+            (language, *batch),
+        )
+        rows.update((row[0], row[1:]) for row in cursor)
+    return rows
+
+
+def near_matches(
+    db: sqlite3.Connection,
+    texts: Sequence[str],
+    indices: Sequence[int],
+    language: str,
+) -> dict[int, tuple[str, str]]:
+    # Repeated intros and ads transcribed a little differently, by index the
+    # key of the matched source and its translation
+    words = {i: words_key(texts[i]) for i in indices}
+    found = select_in(
+        db,
+        "SELECT s.words, s.key, t.text FROM sources s "
+        "JOIN translations t ON t.key = s.key AND t.language = ? WHERE s.words",
+        language,
+        words.values(),
+    )
+    near = {i: found[key] for i, key in words.items() if key in found}
+    for i in indices:
+        if i in near or len(texts[i]) < NEAR_MIN_CHARS:
+            continue
+        value = simhash(texts[i])
+        rows = db.execute(
+            "SELECT s.simhash, s.numbers, s.key, t.text FROM sources s "
+            "JOIN translations t ON t.key = s.key AND t.language = ? "
+            "WHERE s.band0 = ? OR s.band1 = ? OR s.band2 = ? OR s.band3 = ?",
+            (language, *bands(value)),
+        ).fetchall()
+        for other, other_numbers, key, translation in rows:
+            distance = (value ^ (other % (1 << 64))).bit_count()
+            if distance <= NEAR_MAX_DISTANCE and other_numbers == numbers(texts[i]):
+                near[i] = (key, translation)
+                break
+    return near
+
+
+def translation_memory() -> TranslationMemory:
+    return TranslationMemory(
+        settings.cache_dir / "translations.sqlite3",
+        max_bytes=settings.translation_memory_max_size_mb * 1024 * 1024,
+    )
@@ -0,0 +1,209 @@
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95)
+# Numeric span attributes that are also exported as running totals
+TOTALS = (
+    "bytes",
+    "audio_seconds",
+    "saved_seconds",
+    "billed_seconds",
+    "retries",
+    "polls",
+    "cache_hits",
+    "cache_misses",
+)
+
+job_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "job_id",
+    default=None,
+)
+_current: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "span",
+    default=None,
+)
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = attributes
+        self._lock = threading.Lock()
+
+    def set(self, **attributes: Any) -> None:
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + value
+
+
+class Registry:
+    def __init__(self, window: int = 1024) -> None:
+        self.window = window
+        self._durations: dict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window),
+        )
+        self._counts: dict[str, int] = defaultdict(int)
+        self._sums: dict[str, float] = defaultdict(float)
+        self._errors: dict[str, int] = defaultdict(int)
+        self._totals: dict[tuple[str, str], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, span: Span, duration: float, error: bool) -> None:
+        with self._lock:
+            self._durations[span.name].append(duration)
+            self._counts[span.name] += 1
+            self._sums[span.name] += duration
+            if error:
+                self._errors[span.name] += 1
+            for name in TOTALS:
+                value = span.attributes.get(name)
+                if isinstance(value, int | float):
+                    self._totals[span.name, name] += value
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        # Quantiles are computed over the last `window` spans of each name
+        with self._lock:
+            result = {}
+            for name, durations in self._durations.items():
+                ordered = sorted(durations)
+                result[name] = {
+                    **{
+                        f"p{int(q * 100)}": ordered[
+                            min(int(q * len(ordered)), len(ordered) - 1)
+                        ]
+                        for q in QUANTILES
+                    },
+                    "count": self._counts[name],
+                    "sum": self._sums[name],
+                    "errors": self._errors[name],
+                }
+            return result
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines = ["# TYPE transcriber_span_duration_seconds summary"]
+        for name, stats in sorted(self.summary().items()):
+            labels = f'span="{name}"'
+            lines.extend(
+                f'transcriber_span_duration_seconds{{{labels},quantile="{q}"}} '
+                f"{stats[f'p{int(q * 100)}']:.6f}"
+                for q in QUANTILES
+            )
+            lines.append(
+                f"transcriber_span_duration_seconds_sum{{{labels}}} {stats['sum']:.6f}",
+            )
+            lines.append(
+                f"transcriber_span_duration_seconds_count{{{labels}}} {stats['count']}",
+            )
+        lines.append("# TYPE transcriber_span_errors_total counter")
+        with self._lock:
+            lines.extend(
+                f'transcriber_span_errors_total{{span="{name}"}} {count}'
+                for name, count in sorted(self._errors.items())
+            )
+            for total in TOTALS:
+                lines.append(f"# TYPE transcriber_{total}_total counter")
+                lines.extend(
+                    f'transcriber_{total}_total{{span="{name}"}} {value:g}'
+                    for (name, attribute), value in sorted(self._totals.items())
+                    if attribute == total
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path) -> None:
+        # For the node_exporter textfile collector
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(self.render())
+        tmp.replace(path)
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    current = Span(name, attributes)
+    token = _current.set(current)
+    start = time.perf_counter()
+    error: BaseException | None = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current.reset(token)
+        registry.record(current, duration, error is not None)
+        record = {
+            "span": name,
+            "job_id": job_id.get(),
+            "duration": round(duration, 6),
+            "status": "ok" if error is None else "error",
+            **current.attributes,
+        }
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def annotate(**attributes: Any) -> None:
+    # Adds attributes to the innermost open span, if any
+    if current := _current.get():
+        current.set(**attributes)
+
+
+def count(name: str, value: float = 1) -> None:
+    if current := _current.get():
+        current.add(name, value)
+
+
+def configure_logging() -> None:
+    # Spans are logged as one JSON object per line
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def serve(port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)  # noqa: S104
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field
+
+from transcriber.backends import WHISPER_DIARIZATION
+from transcriber.trimming import MAX_TEMPO
+
+
+class JobOptions(BaseModel):
+    mode: str
+    source: str
+    model_name: str = WHISPER_DIARIZATION
+    language: str | None = None
+    diarization: bool = True
+    post_processing: bool = True
+    speaker_identification: bool = True
+    chunking: bool = False
+    chunk_minutes: int = 20
+    streaming: bool = True
+    trim_silence: bool = False
+    tempo: float = Field(default=1.0, ge=1.0, le=MAX_TEMPO)
+    compare: bool = False  # all models side by side instead of the pipeline
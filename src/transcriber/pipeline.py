@@ -0,0 +1,543 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, cast
+
+from transcriber import metrics, settings
+from transcriber.audio import DEFAULT_PROFILE, probe
+from transcriber.backends import (
+    MODELS,
+    PROFILES,
+    delete_upload,
+    estimated_cost,
+    is_diarized,
+    run_model,
+    upload_audio,
+)
+from transcriber.cache import file_digest, make_key
+from transcriber.chunking import merge_transcriptions, run_chunks, split_audio
+from transcriber.errors import PipelineError
+from transcriber.ingest import download
+from transcriber.jobs import Job
+from transcriber.postprocessing import (
+    CORRECTION_WINDOW_CHARS,
+    correct_transcription,
+    identify_speakers,
+    stream_correction,
+)
+from transcriber.transcript import Transcript
+from transcriber.translation import stream_translation, translate_text
+from transcriber.trimming import TimeMap, trim
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterable, Mapping, Sequence
+    from pathlib import Path
+
+    from transcriber.audio import Profile
+    from transcriber.options import JobOptions
+    from transcriber.services import Services
+    from transcriber.transcript import Segment
+    from transcriber.translation import BatchTranslator
+
+logger = logging.getLogger(__name__)
+
+SAVE_INTERVAL_SECONDS = 1.0
+UNSAFE_TRANSLATION = (
+    "The translator thinks the content is unsafe and can't return the translation 🙈"
+)
+# Transcribed chunks waiting for their translation, a full queue holds the
+# transcription back instead of piling texts up
+PREFETCH_QUEUE_SIZE = 2
+
+
+# Saves the job state, the stage name is shown to the user
+Save = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+
+async def transcribe(
+    services: Services,
+    job: Job,
+    options: JobOptions,
+    audio_file_name: Path | None = None,
+) -> Transcript:
+    audio_file_name = audio_file_name or job.converted_file
+    # Hashing the audio and the cache's SQLite calls block, they are made in
+    # the loop's thread pool like the other store calls
+    key, cached = await asyncio.to_thread(
+        cached_transcription,
+        services,
+        job,
+        options,
+        audio_file_name,
+    )
+    if cached is not None:
+        return cached
+    transcript = await run_model(
+        services,
+        job,
+        options.model_name,
+        audio_file_name,
+        options.diarization,
+    )
+    await asyncio.to_thread(
+        cache_transcription,
+        services,
+        job,
+        key,
+        audio_file_name,
+        transcript,
+    )
+    return transcript
+
+
+def cached_transcription(
+    services: Services,
+    job: Job,
+    options: JobOptions,
+    audio_file_name: Path,
+) -> tuple[str, Transcript | None]:
+    with metrics.span("transcription.cache", model=options.model_name) as span:
+        key = make_key(
+            settings.CACHE_VERSION,
+            file_digest(audio_file_name),
+            options.model_name,
+            diarization=options.diarization,
+        )
+        cached = services.cache.get(key)
+        span.set(cache_hits=int(cached is not None), cache_misses=int(cached is None))
+    if cached is None:
+        return key, None
+    job.raw_outputs[str(audio_file_name)] = cached["raw_output"]
+    return key, Transcript.from_dict(cached["transcription"])
+
+
+def cache_transcription(
+    services: Services,
+    job: Job,
+    key: str,
+    audio_file_name: Path,
+    transcript: Transcript,
+) -> None:
+    services.cache.put(
+        key,
+        {
+            "transcription": transcript.to_dict(),
+            "raw_output": job.raw_outputs.get(str(audio_file_name)),
+        },
+    )
+
+
+def cached_correction(services: Services, text: str) -> tuple[str, str | None]:
+    # Keyed on the transcribed text, the same audio transcribed the same way
+    # gives the same text, with what the correction depends on
+    with metrics.span("correction.cache") as span:
+        key = make_key(
+            settings.CACHE_VERSION,
+            "correction",
+            hashlib.sha256(text.encode()).hexdigest(),
+            model=settings.GEMINI_MODEL,
+            thinking=settings.thinking_config(),
+            window_chars=CORRECTION_WINDOW_CHARS,
+        )
+        cached = services.cache.get(key)
+        span.set(cache_hits=int(cached is not None), cache_misses=int(cached is None))
+    return key, None if cached is None else cached["text"]
+
+
+class Prefetch:
+    # Segments translated while later chunks are still transcribed and the
+    # speakers identified, by source text. Failures are left to the translate
+    # stage, which translates whatever is missing and reports the error
+    def __init__(self, translator: BatchTranslator, language: str) -> None:
+        self.translator = translator
+        self.language = language
+        self.translations: dict[str, str] = {}
+        self._queue: asyncio.Queue[list[str] | None] = asyncio.Queue(
+            PREFETCH_QUEUE_SIZE,
+        )
+        self._task = asyncio.create_task(self._translate())
+
+    async def _translate(self) -> None:
+        while (texts := await self._queue.get()) is not None:
+            try:
+                async for i, translation in self.translator.iter_translate(
+                    texts,
+                    self.language,
+                ):
+                    self.translations[texts[i]] = translation
+            except Exception:
+                logger.warning("Translating ahead failed", exc_info=True)
+
+    async def put(self, segments: Sequence[Segment]) -> None:
+        if segments:
+            await self._queue.put([s.text for s in segments])
+
+    async def result(self) -> dict[str, str]:
+        await self._queue.put(None)
+        await self._task
+        return self.translations
+
+    def cancel(self) -> None:
+        self._task.cancel()
+
+
+async def transcribe_whole(run: PipelineRun, audio: Path) -> Transcript:
+    transcript = await transcribe(run.services, run.job, run.options, audio)
+    if run.prefetch is not None:
+        # Translated while the speakers are identified
+        await run.prefetch.put(transcript.segments)
+    return transcript
+
+
+async def transcribe_in_chunks(run: PipelineRun, audio: Path) -> Transcript:
+    services, job, options = run.services, run.job, run.options
+    chunks_dir = job.workdir / "chunks"
+    chunks_dir.mkdir(exist_ok=True)
+    chunks = await split_audio(
+        audio,
+        chunks_dir,
+        chunk_seconds=options.chunk_minutes * 60,
+        overlap=settings.CHUNK_OVERLAP_SECONDS
+        if is_diarized(options.model_name, options.diarization)
+        else 0,
+    )
+    if len(chunks) == 1:
+        return await transcribe_whole(run, audio)
+    transcripts: list[Transcript | None] = [None] * len(chunks)
+    async for i, transcript in run_chunks(
+        chunks,
+        lambda chunk: transcribe(services, job, options, chunk.path),
+        max_workers=settings.MAX_CHUNK_WORKERS,
+    ):
+        transcripts[i] = transcript
+        if run.prefetch is not None:
+            # Only the segments the merge keeps, the overlap is the next chunk's
+            chunk = chunks[i]
+            await run.prefetch.put(
+                [
+                    s
+                    for s in transcript.segments
+                    if s.start + chunk.offset >= chunk.keep_from
+                ],
+            )
+    return merge_transcriptions(chunks, cast("list[Transcript]", transcripts))
+
+
+def throttled(save: Save) -> Save:
+    # Partial results are saved at most once per interval while streaming
+    last = 0.0
+
+    async def save_partial(stage: str, state: dict[str, Any]) -> None:
+        nonlocal last
+        if time.monotonic() - last >= SAVE_INTERVAL_SECONDS:
+            await save(stage, state)
+            last = time.monotonic()
+
+    return save_partial
+
+
+async def collect(
+    chunks: AsyncIterable[str],
+    key: str,
+    stage: str,
+    run: PipelineRun,
+) -> None:
+    # Streamed Gemini responses are consumed here, so the span covers the call
+    save_partial = throttled(run.save)
+    run.state[key] = ""
+    with metrics.span(f"gemini.{stage}.stream") as span:
+        async for chunk in chunks:
+            run.state[key] += chunk
+            await save_partial(stage, run.state)
+        span.set(chars=len(run.state[key]))
+
+
+@dataclass
+class PipelineRun:
+    services: Services
+    job: Job
+    options: JobOptions
+    state: dict[str, Any]
+    save: Save
+    prefetch: Prefetch | None = None
+    # Shared by the jobs running at once, encoding the download waits for one
+    encodes: asyncio.Semaphore | None = None
+
+    @property
+    def transcript(self) -> Transcript:
+        # The job state keeps the compact dict form, it is saved as JSON
+        return Transcript.from_dict(self.state["transcription"])
+
+
+def encoding_profile(options: JobOptions) -> Profile:
+    # Compared models share one file, encoded the default way
+    if options.compare:
+        return DEFAULT_PROFILE
+    return PROFILES.get(options.model_name, DEFAULT_PROFILE)
+
+
+async def download_stage(run: PipelineRun) -> None:
+    run.state["encoding"] = await download(
+        run.job,
+        run.options.mode,
+        run.options.source,
+        settings.proxy,
+        run.services.downloads,
+        encoding_profile(run.options),
+        run.encodes,
+    )
+
+
+async def trim_stage(run: PipelineRun) -> None:
+    if not run.options.trim_silence and run.options.tempo == 1:
+        return
+    trimmed = await trim(
+        run.job.converted_file,
+        run.job.trimmed_file,
+        run.options.tempo,
+        run.options.trim_silence,
+        encoding_profile(run.options),
+    )
+    run.state["time_map"] = trimmed.time_map and trimmed.time_map.to_dict()
+    run.state["trimmed"] = {
+        "audio_seconds": trimmed.audio_seconds,
+        "trimmed_seconds": trimmed.trimmed_seconds,
+    }
+
+
+async def transcribe_stage(run: PipelineRun) -> None:
+    time_map = run.state.get("time_map")
+    audio = run.job.trimmed_file if time_map else run.job.converted_file
+    if run.options.language is not None:
+        run.prefetch = Prefetch(run.services.translator, run.options.language)
+    transcript = await (
+        transcribe_in_chunks(run, audio)
+        if run.options.chunking
+        else transcribe_whole(run, audio)
+    )
+    if time_map:
+        # Timestamps are moved back to the original audio, which is played
+        transcript = TimeMap.from_dict(time_map).restore(transcript)
+    run.state["transcription"] = transcript.to_dict()
+    run.state["prediction_ids"] = run.job.prediction_ids
+    run.state["raw_outputs"] = [out for _, out in sorted(run.job.raw_outputs.items())]
+
+
+async def post_processing_stage(run: PipelineRun) -> None:
+    text = run.transcript.text
+    # for incredibly-fast-whisper (without diarization) and openai/whisper
+    if text is None:
+        return
+    if not run.options.post_processing:
+        run.state["text"] = text
+        return
+    key, cached = await asyncio.to_thread(cached_correction, run.services, text)
+    if cached is not None:
+        run.state["text"] = cached
+        return
+    args = (run.services.gemini_client, text, run.services.translator.rate_limiter)
+    if run.options.streaming:
+        await collect(stream_correction(*args), "text", "post_processing", run)
+    else:
+        run.state["text"] = await correct_transcription(*args)
+    await asyncio.to_thread(run.services.cache.put, key, {"text": run.state["text"]})
+
+
+async def speakers_stage(run: PipelineRun) -> None:
+    transcript = run.transcript
+    if transcript.num_speakers <= 1:
+        return
+    run.state["names"] = (
+        await identify_speakers(
+            run.services.gemini_client,
+            transcript,
+            run.services.translator.rate_limiter,
+        )
+        if run.options.speaker_identification
+        else {speaker: speaker for speaker in transcript.speakers}
+    )
+
+
+async def translate_stage(run: PipelineRun) -> None:
+    if run.options.language is None:
+        return
+    try:
+        if "text" in run.state:
+            await translate_text_stage(run, run.options.language)
+        else:
+            await translate_segments_stage(run, run.options.language)
+    except ValueError as e:
+        raise PipelineError(UNSAFE_TRANSLATION) from e
+
+
+async def translate_text_stage(run: PipelineRun, language: str) -> None:
+    await run.services.translator.rate_limiter.acquire()
+    args = (run.services.gemini_client, settings.GEMINI_MODEL, run.state["text"])
+    if run.options.streaming:
+        chunks = stream_translation(
+            *args,
+            language,
+            thinking_config=settings.thinking_config(),
+        )
+        await collect(chunks, "translation", "translate", run)
+    else:
+        translation = await translate_text(
+            *args,
+            language,
+            thinking_config=settings.thinking_config(),
+        )
+        run.state["translation"] = (
+            run.state["text"] if translation is None else translation
+        )
+
+
+async def translate_segments_stage(run: PipelineRun, language: str) -> None:
+    texts = [s.text for s in run.transcript.segments]
+    prefetched = await run.prefetch.result() if run.prefetch is not None else {}
+    translations = [prefetched.get(text) for text in texts]
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    save_partial = throttled(run.save)
+    if run.options.streaming:
+        # The prefetched segments are shown at once, the rest batch by batch
+        run.state["translations"] = translations
+        await save_partial("translate", run.state)
+    async for j, text in run.services.translator.iter_translate(
+        [texts[i] for i in missing],
+        language,
+    ):
+        translations[missing[j]] = text
+        if run.options.streaming:
+            await save_partial("translate", run.state)
+    run.state["translations"] = translations
+
+
+async def compare_model(
+    run: PipelineRun,
+    model: str,
+    audio_file_name: Path,
+    url: str,
+) -> dict[str, Any]:
+    job, options = comparison_job(run, model, audio_file_name, url)
+    started = time.perf_counter()
+    try:
+        transcript = await transcribe(run.services, job, options, audio_file_name)
+    except PipelineError as e:
+        return {"model": model, "error": str(e)}
+    except Exception:
+        logger.exception("%s failed in comparison", model)
+        return {"model": model, "error": "Model error 😫"}
+    audio_seconds = (await probe(audio_file_name))["duration"]
+    return comparison(run, model, job, transcript, started, audio_seconds)
+
+
+def comparison_job(
+    run: PipelineRun,
+    model: str,
+    audio_file_name: Path,
+    url: str,
+) -> tuple[Job, JobOptions]:
+    # Every model gets its own job, for its own prediction ids and billing
+    job = Job(
+        id=run.job.id,
+        workdir=run.job.workdir,
+        audio_urls={str(audio_file_name): url},
+    )
+    return job, run.options.model_copy(update={"model_name": model})
+
+
+def comparison(  # noqa: PLR0913, PLR0917
+    run: PipelineRun,
+    model: str,
+    job: Job,
+    transcript: Transcript,
+    started: float,
+    audio_seconds: float,
+) -> dict[str, Any]:
+    if time_map := run.state.get("time_map"):
+        transcript = TimeMap.from_dict(time_map).restore(transcript)
+    return {
+        "model": model,
+        "error": None,
+        "transcription": transcript.to_dict(),
+        "latency": time.perf_counter() - started,
+        "billed_seconds": job.billed_seconds,
+        "cost": estimated_cost(model, job.billed_seconds, audio_seconds),
+        "cached": not job.prediction_ids,
+        "prediction_ids": job.prediction_ids,
+    }
+
+
+async def compare_stage(run: PipelineRun) -> None:
+    # The audio is uploaded once and all models transcribe it at the same time
+    time_map = run.state.get("time_map")
+    audio = run.job.trimmed_file if time_map else run.job.converted_file
+    upload = await upload_audio(run.services, audio)
+    try:
+        results = await asyncio.gather(
+            *(compare_model(run, model, audio, upload.urls["get"]) for model in MODELS),
+        )
+    finally:
+        await delete_upload(run.services, upload)
+    if all(r["error"] for r in results):
+        raise PipelineError(results[0]["error"])
+    run.state["comparison"] = results
+
+
+Stage = Callable[[PipelineRun], Awaitable[None]]
+
+STAGES: dict[str, Stage] = {
+    "download": download_stage,
+    "trim": trim_stage,
+    "transcribe": transcribe_stage,
+    "post_processing": post_processing_stage,
+    "speakers": speakers_stage,
+    "translate": translate_stage,
+}
+
+
+COMPARE_STAGES: dict[str, Stage] = {
+    "download": download_stage,
+    "trim": trim_stage,
+    "compare": compare_stage,
+}
+
+
+def resume(run: PipelineRun) -> list[str]:
+    # The completed stages, without the ones whose files are gone
+    completed: list[str] = run.state.setdefault("completed", [])
+    if not run.job.converted_file.exists() and "download" in completed:
+        completed.remove("download")
+    if (
+        run.state.get("time_map")
+        and not run.job.trimmed_file.exists()
+        and not {"transcribe", "compare"} & set(completed)
+    ):
+        completed.remove("trim")
+    return completed
+
+
+async def run_pipeline(
+    run: PipelineRun,
+    limits: Mapping[str, asyncio.Semaphore] | None = None,
+) -> None:
+    # Every stage result is saved, so a restarted job resumes after the last one.
+    # Stages with a limit wait for a free slot, shared by the jobs running at once
+    completed = resume(run)
+    stages = COMPARE_STAGES if run.options.compare else STAGES
+    try:
+        for stage, run_stage in stages.items():
+            if stage in completed:
+                continue
+            await run.save(stage, run.state)
+            async with (limits or {}).get(stage) or contextlib.nullcontext():
+                with metrics.span(f"stage.{stage}", model=run.options.model_name):
+                    await run_stage(run)
+            completed.append(stage)
+            await run.save(stage, run.state)
+    finally:
+        if run.prefetch is not None:
+            run.prefetch.cancel()
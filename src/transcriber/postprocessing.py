@@ -0,0 +1,259 @@
+import asyncio
+import functools
+import itertools
+import re
+from collections import defaultdict
+from typing import TYPE_CHECKING, NamedTuple, cast
+
+from pydantic import BaseModel
+
+from transcriber import metrics
+from transcriber.errors import PipelineError
+from transcriber.settings import GEMINI_MODEL, thinking_config
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Sequence
+
+    from google import genai
+    from google.genai import types
+
+    from transcriber.ratelimit import TokenBucket
+    from transcriber.transcript import Transcript
+
+# Long texts are corrected in windows at once, each output stays well under
+# the output token limit
+CORRECTION_WINDOW_CHARS = 12_000
+CORRECTION_CONTEXT_CHARS = 1_000
+MAX_CORRECTION_WORKERS = 4
+SENTENCE_END_RE = re.compile(r"[.!?…]+[\"')\]]*\s+")
+# Speaker identification sees about this much text of every speaker
+SPEAKER_SAMPLE_CHARS = 3_000
+SAMPLE_HEAD_SEGMENTS = 5
+SAMPLE_SPREAD_SEGMENTS = 10
+SAMPLE_SEGMENT_CHARS = 300
+
+
+class SpeakerMapping(BaseModel):
+    original_speaker: str
+    detected_speaker: str
+
+
+class Window(NamedTuple):
+    # text[start:end] is corrected, the text around it is only context
+    start: int
+    end: int
+    before: str
+    after: str
+
+
+def split_windows(
+    text: str,
+    size: int = CORRECTION_WINDOW_CHARS,
+    context: int = CORRECTION_CONTEXT_CHARS,
+) -> list[Window]:
+    # Cut at sentence ends, or at spaces, in the second half of every window,
+    # so the windows cover the text exactly once
+    bounds = [0]
+    while len(text) - bounds[-1] > size:
+        start = bounds[-1]
+        ends = list(SENTENCE_END_RE.finditer(text, start + size // 2, start + size))
+        cut = ends[-1].end() if ends else text.rfind(" ", start + 1, start + size) + 1
+        bounds.append(cut if cut > start else start + size)
+    bounds.append(len(text))
+    return [
+        Window(a, b, text[max(a - context, 0) : a], text[b : b + context])
+        for a, b in itertools.pairwise(bounds)
+    ]
+
+
+def separator(text: str, window: Window) -> str:
+    # The whitespace the text had where the window starts, the corrected
+    # windows are stripped
+    core = text[window.start : window.end]
+    return (
+        window.before[len(window.before.rstrip()) :]
+        + core[: len(core) - len(core.lstrip())]
+    )
+
+
+@functools.cache
+def correction_config() -> types.GenerateContentConfig:
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        system_instruction=None,
+        response_mime_type="text/plain",
+        thinking_config=thinking_config(),
+    )
+
+
+def correction_prompt(transcription: str, window: Window | None = None) -> str:
+    prompt = f"Correct any spelling discrepancies in the transcribed text. Split text by speaker. Only add necessary punctuation such as periods, commas, and capitalization, and use only the context provided: <transcribed_text>{transcription}</transcribed_text>"
+    if window is None or not (window.before or window.after):
+        return prompt
+    return (
+        f"{prompt} It is a part of a longer transcription. The text right before and after it is given only as context, return the corrected transcribed text alone: "
+        f"<text_before>{window.before}</text_before><text_after>{window.after}</text_after>"
+    )
+
+
+async def correct_window(
+    client: genai.Client,
+    text: str,
+    window: Window,
+    rate_limiter: TokenBucket | None = None,
+) -> str:
+    core = text[window.start : window.end]
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
+    with metrics.span("gemini.correction", chars=len(core)):
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=correction_prompt(core, window),
+            config=correction_config(),
+        )
+    return (response.text or core).strip()
+
+
+async def iter_corrections(
+    client: genai.Client,
+    text: str,
+    windows: Sequence[Window],
+    rate_limiter: TokenBucket | None = None,
+) -> AsyncIterator[str]:
+    # Windows are corrected in parallel and yielded in order
+    slots = asyncio.Semaphore(MAX_CORRECTION_WORKERS)
+
+    async def correct(window: Window) -> str:
+        async with slots:
+            return await correct_window(client, text, window, rate_limiter)
+
+    tasks = [asyncio.create_task(correct(window)) for window in windows]
+    try:
+        for i, (window, task) in enumerate(zip(windows, tasks, strict=True)):
+            yield (separator(text, window) if i else "") + await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def correct_transcription(
+    client: genai.Client,
+    transcription: str,
+    rate_limiter: TokenBucket | None = None,
+) -> str:
+    windows = split_windows(transcription)
+    corrections = iter_corrections(client, transcription, windows, rate_limiter)
+    return "".join([correction async for correction in corrections])
+
+
+async def stream_correction(
+    client: genai.Client,
+    transcription: str,
+    rate_limiter: TokenBucket | None = None,
+) -> AsyncIterator[str]:
+    windows = split_windows(transcription)
+    if len(windows) > 1:
+        async for correction in iter_corrections(
+            client,
+            transcription,
+            windows,
+            rate_limiter,
+        ):
+            yield correction
+        return
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
+    async for chunk in await client.aio.models.generate_content_stream(
+        model=GEMINI_MODEL,
+        contents=correction_prompt(transcription),
+        config=correction_config(),
+    ):
+        if chunk.text:
+            yield chunk.text
+
+
+def sample_segments(
+    transcript: Transcript,
+    max_chars: int = SPEAKER_SAMPLE_CHARS,
+) -> list[int]:
+    # The first segments of every speaker, where introductions usually are,
+    # then a spread of the rest, each with the segment before it, where the
+    # others tend to address them by name
+    segments = transcript.segments
+    by_speaker: dict[str, list[int]] = defaultdict(list)
+    for i, segment in enumerate(segments):
+        if segment.speaker is not None:
+            by_speaker[segment.speaker].append(i)
+    chosen: set[int] = set()
+    for indices in by_speaker.values():
+        rest = indices[SAMPLE_HEAD_SEGMENTS:]
+        spread = rest[:: max(len(rest) // SAMPLE_SPREAD_SEGMENTS, 1)]
+        size = 0
+        for i in indices[:SAMPLE_HEAD_SEGMENTS] + spread:
+            if size >= max_chars:
+                break
+            chosen.update((i, i - 1) if i else (i,))
+            size += min(len(segments[i].text), SAMPLE_SEGMENT_CHARS)
+    return sorted(chosen)
+
+
+def speaker_sample(transcript: Transcript) -> str:
+    lines: list[str] = []
+    previous = -1
+    for i in sample_segments(transcript):
+        segment = transcript.segments[i]
+        if previous >= 0 and i != previous + 1:
+            lines.append("...")
+        text = segment.text.strip()[:SAMPLE_SEGMENT_CHARS]
+        lines.append(f"{segment.speaker or 'UNKNOWN'}: {text}")
+        previous = i
+    return "\n".join(lines)
+
+
+def speakers_prompt(transcript: Transcript) -> str:
+    return (
+        f'Identify speaker names from context and map each "SPEAKER_XX" label to the identified name in these excerpts of a transcription, one segment per line, "..." where segments were left out: <transcribed_excerpts>{speaker_sample(transcript)}</transcribed_excerpts>. '
+        'If a speaker cannot be identified, return their original label as the detected name (e.g. original_speaker="SPEAKER_00", detected_speaker="SPEAKER_00"). '
+        "Return one entry per unique speaker."
+    )
+
+
+def speakers_config() -> types.GenerateContentConfig:
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        system_instruction=None,
+        response_mime_type="application/json",
+        response_schema=list[SpeakerMapping],
+        thinking_config=thinking_config(),
+    )
+
+
+def speaker_names(
+    transcript: Transcript,
+    response: types.GenerateContentResponse,
+) -> dict[str, str]:
+    defaults = {speaker: speaker for speaker in transcript.speakers}
+    parsed = cast("list[SpeakerMapping] | None", response.parsed)
+    if not parsed:
+        msg = "Can't identify speakers 🙈"
+        raise PipelineError(msg)
+    return {**defaults, **{m.original_speaker: m.detected_speaker for m in parsed}}
+
+
+async def identify_speakers(
+    client: genai.Client,
+    transcript: Transcript,
+    rate_limiter: TokenBucket | None = None,
+) -> dict[str, str]:
+    prompt = speakers_prompt(transcript)
+    if rate_limiter is not None:
+        await rate_limiter.acquire()
+    with metrics.span("gemini.speakers", chars=len(prompt)):
+        response = await client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config=speakers_config(),
+        )
+    return speaker_names(transcript, response)
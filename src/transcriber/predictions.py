@@ -0,0 +1,141 @@
+import asyncio
+import contextlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any
+
+from transcriber import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    import replicate
+    from replicate.prediction import Prediction
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+
+class PredictionError(RuntimeError):
+    pass
+
+
+class WebhookReceiver:
+    # Webhooks only wake the waiting task up early; the result is always
+    # reloaded from the API, so an unsigned or spoofed request can't inject output.
+    def __init__(self, public_url: str, port: int, history: int = 1024) -> None:
+        self.public_url = public_url
+        self._completed: OrderedDict[str, None] = OrderedDict()
+        self._wakers: dict[str, Callable[[], None]] = {}
+        self._history = history
+        self._lock = threading.Lock()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    prediction_id = json.loads(self.rfile.read(length))["id"]
+                except ValueError, KeyError, TypeError:
+                    self.send_response(400)
+                else:
+                    receiver.notify(prediction_id)
+                    self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer(("0.0.0.0", port), Handler)  # noqa: S104
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def notify(self, prediction_id: str) -> None:
+        with self._lock:
+            self._completed[prediction_id] = None
+            while len(self._completed) > self._history:
+                self._completed.popitem(last=False)
+            if wake := self._wakers.get(prediction_id):
+                wake()
+
+    def event_for(self, prediction_id: str) -> asyncio.Event:
+        # Set from the server thread in the loop that waits for it
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            self._wakers[prediction_id] = lambda: loop.call_soon_threadsafe(event.set)
+            if prediction_id in self._completed:
+                event.set()
+        return event
+
+    def release(self, prediction_id: str) -> None:
+        with self._lock:
+            self._wakers.pop(prediction_id, None)
+
+
+def prediction_kwargs(
+    model_input: dict[str, Any],
+    webhook: WebhookReceiver | None = None,
+) -> dict[str, Any]:
+    kwargs: dict[str, Any] = {"input": model_input}
+    if webhook is not None:
+        kwargs |= {
+            "webhook": webhook.public_url,
+            "webhook_events_filter": ["completed"],
+        }
+    return kwargs
+
+
+async def create_prediction(
+    client: replicate.Client,
+    model: str,
+    version: str | None,
+    model_input: dict[str, Any],
+    webhook: WebhookReceiver | None = None,
+) -> Prediction:
+    # The client's httpx.AsyncClient, files in the input are uploaded with it
+    kwargs = prediction_kwargs(model_input, webhook)
+    if version is None:
+        return await client.models.predictions.async_create(model=model, **kwargs)
+    return await client.predictions.async_create(version=version, **kwargs)
+
+
+async def wait_for_prediction(
+    prediction: Prediction,
+    webhook: WebhookReceiver | None = None,
+    initial_delay: float = 1,
+    max_delay: float = 30,
+) -> Prediction:
+    import httpx
+
+    event = webhook.event_for(prediction.id) if webhook is not None else None
+    delay = initial_delay
+    try:
+        while prediction.status not in TERMINAL_STATUSES:
+            if event is None:
+                await asyncio.sleep(delay)
+            else:
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(event.wait(), delay)
+                event.clear()
+            try:
+                metrics.count("polls")
+                await prediction.async_reload()
+            except httpx.TransportError:
+                metrics.count("retries")
+                logger.warning("Polling prediction %s failed, retrying", prediction.id)
+            delay = min(delay * 2, max_delay)
+    finally:
+        if webhook is not None:
+            webhook.release(prediction.id)
+    return succeeded(prediction)
+
+
+def succeeded(prediction: Prediction) -> Prediction:
+    if prediction.status != "succeeded":
+        msg = f"Prediction {prediction.id} {prediction.status}: {prediction.error}"
+        raise PredictionError(msg)
+    return prediction
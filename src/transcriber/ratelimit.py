@@ -0,0 +1,36 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float, capacity: int = 1) -> None:
+        if requests_per_minute <= 0:
+            msg = "requests_per_minute must be positive"
+            raise ValueError(msg)
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate,
+        )
+        self._updated = now
+
+    def _take(self) -> float:
+        # 0 when a token was taken, otherwise how long until there is one
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while wait := self._take():
+            await asyncio.sleep(wait)
@@ -0,0 +1,68 @@
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from transcriber import settings
+from transcriber.backends import VERSIONED_MODELS
+from transcriber.cache import TranscriptionCache, transcription_cache
+from transcriber.downloads import DownloadCache, download_cache
+from transcriber.memory import translation_memory
+from transcriber.predictions import WebhookReceiver
+from transcriber.ratelimit import TokenBucket
+from transcriber.translation import BatchTranslator
+from transcriber.versions import ModelVersionResolver, parse_pins
+
+if TYPE_CHECKING:
+    import replicate
+    from google import genai
+
+
+@dataclass
+class Services:
+    gemini_client: genai.Client
+    replicate_client: replicate.Client
+    hf_access_token: str
+    cache: TranscriptionCache
+    translator: BatchTranslator
+    versions: ModelVersionResolver
+    webhook: WebhookReceiver | None = None
+    downloads: DownloadCache | None = None
+
+    @classmethod
+    def from_env(cls, cache: TranscriptionCache | None = None) -> Services:
+        # The clients take a while to import, only the worker needs them
+        import replicate
+        from google import genai
+
+        gemini_client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
+        replicate_client = replicate.Client(
+            api_token=os.environ["REPLICATE_API_TOKEN"],
+        )
+        versions = ModelVersionResolver(
+            replicate_client,
+            ttl=settings.model_version_ttl,
+            pins=parse_pins(settings.replicate_model_versions),
+            path=settings.cache_dir / "model_versions.json",
+        )
+        versions.warm(VERSIONED_MODELS)
+        return cls(
+            gemini_client=gemini_client,
+            replicate_client=replicate_client,
+            hf_access_token=os.environ["HF_ACCESS_TOKEN"],
+            cache=cache or transcription_cache(),
+            translator=BatchTranslator(
+                gemini_client,
+                settings.GEMINI_MODEL,
+                TokenBucket(settings.gemini_requests_per_minute),
+                thinking_config=settings.thinking_config(),
+                memory=translation_memory(),
+            ),
+            versions=versions,
+            webhook=WebhookReceiver(
+                settings.replicate_webhook_url,
+                settings.replicate_webhook_port,
+            )
+            if settings.replicate_webhook_url
+            else None,
+            downloads=download_cache(),
+        )
@@ -0,0 +1,57 @@
+import functools
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# Google Gemini config
+GEMINI_MODEL = "gemini-3.7-flash"
+gemini_requests_per_minute = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "10"))
+
+# Replicate.com config
+replicate_webhook_url = os.environ.get("REPLICATE_WEBHOOK_URL")
+replicate_webhook_port = int(os.environ.get("REPLICATE_WEBHOOK_PORT", "8765"))
+replicate_model_versions = os.environ.get("REPLICATE_MODEL_VERSIONS")
+model_version_ttl = float(os.environ.get("MODEL_VERSION_TTL_SECONDS", "3600"))
+
+# incredibly-fast-whisper chunks of one speaker at most this far apart are merged
+merge_gap_seconds = float(os.environ.get("MERGE_GAP_SECONDS", "2"))
+
+# Proxy config
+proxy = os.environ.get("PROXY")
+
+# Cache config
+cache_dir = Path(os.environ.get("CACHE_DIR", ".cache"))
+cache_max_size_mb = int(os.environ.get("CACHE_MAX_SIZE_MB", "512"))
+translation_memory_max_size_mb = int(
+    os.environ.get("TRANSLATION_MEMORY_MAX_SIZE_MB", "256"),
+)
+# Downloaded audio, 0 turns the download cache off
+download_cache_max_size_mb = int(os.environ.get("DOWNLOAD_CACHE_MAX_SIZE_MB", "2048"))
+
+# Jobs config
+jobs_dir = Path(os.environ.get("JOBS_DIR", str(cache_dir / "jobs")))
+# Jobs are tasks of one event loop, mostly waiting for the models
+max_concurrent_jobs = int(os.environ.get("MAX_CONCURRENT_JOBS", "32"))
+job_retention_hours = float(os.environ.get("JOB_RETENTION_HOURS", "24"))
+run_worker = os.environ.get("RUN_WORKER", "true").lower() in {"1", "true", "yes"}
+
+# Metrics config
+metrics_port = int(os.environ.get("METRICS_PORT", "0"))
+metrics_file = os.environ.get("METRICS_FILE")
+
+
+@functools.cache
+def thinking_config() -> types.ThinkingConfig:
+    # google.genai is slow to import, the app doesn't need it to start
+    from google.genai import types
+
+    return types.ThinkingConfig(thinking_level=types.ThinkingLevel.HIGH)
+
+
+# Constants
+CHUNK_OVERLAP_SECONDS = 30
+MAX_CHUNK_WORKERS = 4
+CACHE_VERSION = 3  # bump when the cached value layout changes
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from transcriber import settings
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINAL_STATUSES = {DONE, FAILED}
+
+_COLUMNS = (
+    "id, status, stage, options, state, error, workdir, attempts, created, updated"
+)
+
+
+class JobRecord(NamedTuple):
+    id: str
+    status: str
+    stage: str | None
+    options: dict[str, Any]
+    state: dict[str, Any]
+    error: str | None
+    workdir: str
+    attempts: int
+    created: float
+    updated: float
+
+    @classmethod
+    def from_row(cls, row: tuple[Any, ...]) -> JobRecord:
+        fields = list(row)
+        fields[3] = json.loads(fields[3])
+        fields[4] = json.loads(fields[4])
+        return cls(*fields)
+
+
+class JobStore:
+    def __init__(self, path: Path, max_attempts: int = 3) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, "
+                "options TEXT NOT NULL, state TEXT NOT NULL, error TEXT, "
+                "workdir TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, updated REAL NOT NULL, "
+                "worker TEXT, lease_until REAL)",
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)",
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, job_id: str, workdir: Path, options: dict[str, Any]) -> None:
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT INTO jobs (id, status, options, state, workdir, created, updated) "
+                "VALUES (?, ?, ?, '{}', ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(options), str(workdir), now, now),
+            )
+
+    def get(self, job_id: str) -> JobRecord | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id = ?",  # noqa: S608
+                (job_id,),
+            ).fetchone()
+        return None if row is None else JobRecord.from_row(row)
+
+    def claim(self, worker: str, lease: float) -> JobRecord | None:
+        # Takes the oldest queued job, or a running one whose worker stopped
+        # renewing its lease. A single UPDATE is atomic across processes.
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, "  # noqa: S608
+                "attempts = attempts + 1, updated = ? "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? "
+                "OR (status = ? AND lease_until < ?) ORDER BY created LIMIT 1) "
+                f"RETURNING {_COLUMNS}",
+                (RUNNING, worker, now + lease, now, QUEUED, RUNNING, now),
+            ).fetchone()
+        return None if row is None else JobRecord.from_row(row)
+
+    def renew(self, worker: str, lease: float) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = ?",
+                (time.time() + lease, worker, RUNNING),
+            )
+
+    def save(self, job_id: str, stage: str | None, state: dict[str, Any]) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET stage = ?, state = ?, updated = ? WHERE id = ?",
+                (stage, json.dumps(state), time.time(), job_id),
+            )
+
+    def finish(self, job_id: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, worker = NULL, "
+                "updated = ? WHERE id = ?",
+                (DONE, time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker = NULL, "
+                "updated = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+
+    def expired(self, before: float) -> list[JobRecord]:
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE status IN (?, ?) AND updated < ?",  # noqa: S608
+                (DONE, FAILED, before),
+            ).fetchall()
+        return [JobRecord.from_row(row) for row in rows]
+
+    def delete(self, job_id: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def counts(self) -> dict[str, int]:
+        with closing(self._connect()) as db:
+            return dict(
+                db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"),
+            )
+
+
+def job_store() -> JobStore:
+    return JobStore(settings.jobs_dir / "jobs.sqlite3")
@@ -0,0 +1,164 @@
+import sys
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+# incredibly-fast-whisper chunks of one speaker closer than this are one segment
+MAX_MERGE_GAP_SECONDS = 2.0
+
+
+class SpeakerStats(NamedTuple):
+    talk_seconds: float
+    turns: int  # runs of segments without another speaker in between
+    segments: int
+
+
+@dataclass(slots=True)
+class Segment:
+    start: float
+    end: float | None
+    text: str
+    speaker: str | None = None
+
+    def shifted(self, offset: float) -> Segment:
+        return Segment(
+            self.start + offset,
+            None if self.end is None else self.end + offset,
+            self.text,
+            self.speaker,
+        )
+
+
+@dataclass(slots=True)
+class Transcript:
+    # Undiarized models return plain text and no segments
+    segments: list[Segment] = field(default_factory=list)
+    text: str | None = None
+    num_speakers: int = 0
+
+    @property
+    def speakers(self) -> list[str]:
+        return list(dict.fromkeys(s.speaker for s in self.segments if s.speaker))
+
+    def speaker_stats(self) -> dict[str, SpeakerStats]:
+        stats: dict[str, SpeakerStats] = {}
+        previous: str | None = None
+        for i, segment in enumerate(self.segments):
+            label = segment.speaker
+            if label is not None:
+                end = segment.end
+                if end is None:
+                    # Open segments last until the next one starts
+                    following = self.segments[i + 1 : i + 2]
+                    end = following[0].start if following else segment.start
+                talk, turns, count = stats.get(label, (0.0, 0, 0))
+                stats[label] = SpeakerStats(
+                    talk + max(end - segment.start, 0),
+                    turns + (label != previous),
+                    count + 1,
+                )
+            previous = label
+        return stats
+
+    def to_dict(self) -> dict[str, Any]:
+        # Compact JSON form for the cache and the job state
+        return {
+            "num_speakers": self.num_speakers,
+            "text": self.text,
+            "segments": [[s.start, s.end, s.speaker, s.text] for s in self.segments],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Transcript:
+        return cls(
+            [
+                Segment(start, end, text, speaker and sys.intern(speaker))
+                for start, end, speaker, text in data["segments"]
+            ],
+            data["text"],
+            data["num_speakers"],
+        )
+
+
+def speaker(label: Any) -> str | None:
+    # Interned, so equal labels share one string and compare by identity first
+    return sys.intern(str(label)) if label is not None else None
+
+
+def seconds(value: Any) -> float | None:
+    return None if value is None else float(value)
+
+
+def count_speakers(segments: Iterable[Segment]) -> int:
+    return len({s.speaker for s in segments if s.speaker is not None})
+
+
+def from_segments(output: Iterable[dict[str, Any]]) -> list[Segment]:
+    # whisper-diarization and whisperx segments
+    return [
+        Segment(
+            float(s["start"]),
+            seconds(s.get("end")),
+            str(s["text"]),
+            speaker(s.get("speaker")),
+        )
+        for s in output
+    ]
+
+
+def from_whisper_diarization(output: dict[str, Any]) -> Transcript:
+    segments = from_segments(output["segments"])
+    return Transcript(segments, num_speakers=output.get("num_speakers") or 0)
+
+
+def merge_chunks(
+    chunks: Iterable[dict[str, Any]],
+    max_gap: float = MAX_MERGE_GAP_SECONDS,
+) -> list[Segment]:
+    # Consecutive chunks of one speaker at most max_gap apart are one segment,
+    # found in one pass. The texts of a segment are joined once at the end
+    segments: list[Segment] = []
+    texts: list[list[str]] = []
+    previous_end: float | None = None
+    for chunk in chunks:
+        start, end = seconds(chunk["timestamp"][0]), seconds(chunk["timestamp"][1])
+        label = speaker(chunk["speaker"])
+        if (
+            segments
+            and segments[-1].speaker is label
+            and start is not None
+            and previous_end is not None
+            and start - previous_end <= max_gap
+        ):
+            segments[-1].end = end
+            texts[-1].append(chunk["text"])
+        else:
+            segments.append(Segment(start or 0.0, end, "", label))
+            texts.append([chunk["text"]])
+        previous_end = end
+    for segment, group in zip(segments, texts, strict=True):
+        segment.text = " ".join(group)
+    return segments
+
+
+def from_incredibly_fast_whisper(
+    output: Any,
+    diarization: bool,
+    max_gap: float = MAX_MERGE_GAP_SECONDS,
+) -> Transcript:
+    if not diarization:
+        return Transcript(text=output["text"])
+    segments = merge_chunks(output, max_gap)
+    return Transcript(segments, num_speakers=count_speakers(segments))
+
+
+def from_openai(output: Iterable[str]) -> Transcript:
+    return Transcript(text="".join(output))
+
+
+def from_whisperx(output: dict[str, Any], diarization: bool) -> Transcript:
+    segments = from_segments(output["segments"])
+    num_speakers = count_speakers(segments) if diarization else 1
+    return Transcript(segments, num_speakers=num_speakers)
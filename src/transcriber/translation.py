@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import time
+from textwrap import dedent
+from typing import TYPE_CHECKING, cast
+
+from pydantic import BaseModel
+
+from transcriber import metrics
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Sequence
+
+    from google import genai
+    from google.genai import types
+
+    from transcriber.memory import TranslationMemory
+    from transcriber.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_INSTRUCTION = dedent("""
+    You are a language model specializing in accurate, context-sensitive translations.
+    Translate each text with precise meaning and maintain the original tone and style.
+    Adapt idioms, cultural references, and metaphors for naturalness in the target language,
+    while providing brief explanations directly in the text, if necessary.
+    Avoid literal translations unless they are essential.
+    When terms have multiple meanings, use the context to select the best fit.
+    Do not translate proper nouns or technical terms unless widely recognized equivalents exist.
+    Ensure consistent terminology, especially for technical or specialized language.
+    Use polite, respectful language, adjusting formality as appropriate for the text type (e.g., legal, business, casual).
+    I want you to only reply the translation, do not write notes or explanations.
+    """).strip()
+
+
+class TranslatedSegment(BaseModel):
+    id: int
+    text: str
+
+
+def pack_batches(
+    texts: Sequence[str],
+    max_chars: int,
+    max_segments: int,
+) -> list[list[int]]:
+    batches: list[list[int]] = []
+    current: list[int] = []
+    size = 0
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        if current and (size + len(text) > max_chars or len(current) >= max_segments):
+            batches.append(current)
+            current, size = [], 0
+        current.append(i)
+        size += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def translation_prompt(text: str, target_language: str) -> str:
+    return f"Translate input text to {target_language}. Return only translated text: <input_text>{text}</input_text>"
+
+
+def text_config(
+    thinking_config: types.ThinkingConfig | None = None,
+) -> types.GenerateContentConfig:
+    # google.genai is slow to import, it is loaded on the first request
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_INSTRUCTION,
+        response_mime_type="text/plain",
+        thinking_config=thinking_config,
+    )
+
+
+async def translate_text(
+    client: genai.Client,
+    model: str,
+    text: str,
+    target_language: str,
+    thinking_config: types.ThinkingConfig | None = None,
+) -> str | None:
+    # None when the model returned no text
+    with metrics.span("gemini.translate", model=model, chars=len(text)):
+        translation = await client.aio.models.generate_content(
+            model=model,
+            contents=translation_prompt(text, target_language),
+            config=text_config(thinking_config),
+        )
+    return translation.text
+
+
+async def stream_translation(
+    client: genai.Client,
+    model: str,
+    text: str,
+    target_language: str,
+    thinking_config: types.ThinkingConfig | None = None,
+) -> AsyncIterator[str]:
+    async for chunk in await client.aio.models.generate_content_stream(
+        model=model,
+        contents=translation_prompt(text, target_language),
+        config=text_config(thinking_config),
+    ):
+        if chunk.text:
+            yield chunk.text
+
+
+def batch_prompt(batch: dict[int, str], target_language: str) -> str:
+    payload = json.dumps(
+        [{"id": i, "text": text} for i, text in batch.items()],
+        ensure_ascii=False,
+    )
+    return (
+        f"Translate the text of every segment to {target_language}. "
+        "Keep each id unchanged and return exactly one entry per input segment: "
+        f"<input_segments>{payload}</input_segments>"
+    )
+
+
+def parse_batch(
+    response: types.GenerateContentResponse,
+    batch: dict[int, str],
+) -> dict[int, str]:
+    parsed = cast("list[TranslatedSegment] | None", response.parsed) or []
+    return {s.id: s.text for s in parsed if s.id in batch and s.text.strip()}
+
+
+def pending_texts(
+    texts: Sequence[str],
+    remembered: dict[int, str],
+) -> dict[str, list[int]]:
+    # Indices of every text still to translate, repeated ones are translated once
+    pending: dict[str, list[int]] = {}
+    for i, text in enumerate(texts):
+        if i not in remembered:
+            pending.setdefault(text, []).append(i)
+    return pending
+
+
+class BatchTranslator:
+    def __init__(  # noqa: PLR0913
+        self,
+        client: genai.Client,
+        model: str,
+        rate_limiter: TokenBucket,
+        *,
+        thinking_config: types.ThinkingConfig | None = None,
+        max_workers: int = 4,
+        max_batch_chars: int = 8000,
+        max_batch_segments: int = 100,
+        max_retries: int = 3,
+        memory: TranslationMemory | None = None,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.rate_limiter = rate_limiter
+        self.thinking_config = thinking_config
+        self.max_workers = max_workers
+        self.max_batch_chars = max_batch_chars
+        self.max_batch_segments = max_batch_segments
+        self.max_retries = max_retries
+        self.memory = memory
+
+    async def translate(
+        self,
+        texts: Sequence[str],
+        target_language: str,
+    ) -> list[str]:
+        translations = list(texts)
+        async for i, text in self.iter_translate(texts, target_language):
+            translations[i] = text
+        return translations
+
+    async def iter_translate(
+        self,
+        texts: Sequence[str],
+        target_language: str,
+    ) -> AsyncIterator[tuple[int, str]]:
+        # Yields (index, translation) pairs, remembered ones first, the rest as
+        # soon as their batch is done. Repeated segments are translated once
+        # Hashing the texts and SQLite block, the memory is used in a thread
+        remembered = (
+            await asyncio.to_thread(self.memory.lookup, texts, target_language)
+            if self.memory
+            else {}
+        )
+        for item in remembered.items():
+            yield item
+        pending = pending_texts(texts, remembered)
+        unique = list(pending)
+        translated: list[tuple[str, str]] = []
+        try:
+            async for j, translation in self._iter_translate(
+                unique,
+                target_language,
+            ):
+                text = unique[j]
+                if translation is not None and text.strip():
+                    translated.append((text, translation))
+                for i in pending[text]:
+                    # Left as it is, and not remembered, when the model gave nothing
+                    yield i, text if translation is None else translation
+        finally:
+            # Also what was done before a failure, the retried job gets it back
+            if self.memory:
+                await asyncio.to_thread(
+                    self.memory.store,
+                    translated,
+                    target_language,
+                )
+
+    async def _iter_translate(
+        self,
+        texts: Sequence[str],
+        target_language: str,
+    ) -> AsyncIterator[tuple[int, str | None]]:
+        batches = pack_batches(texts, self.max_batch_chars, self.max_batch_segments)
+        batched = {i for batch in batches for i in batch}
+        for i, text in enumerate(texts):
+            if i not in batched:
+                yield i, text
+        slots = asyncio.Semaphore(self.max_workers)
+        done: asyncio.Queue[tuple[list[int], dict[int, str]]] = asyncio.Queue()
+
+        async def translate_batch(batch: list[int]) -> None:
+            async with slots:
+                translated = await self._translate_batch(
+                    {i: texts[i] for i in batch},
+                    target_language,
+                )
+            done.put_nowait((batch, translated))
+
+        tasks = [asyncio.create_task(translate_batch(batch)) for batch in batches]
+        failed: list[int] = []
+        try:
+            for _ in batches:
+                batch, translated = await done.get()
+                for i in batch:
+                    if i in translated:
+                        yield i, translated[i]
+                    else:
+                        failed.append(i)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if failed:
+            logger.warning("Retrying %d segments one by one", len(failed))
+            async for item in self._retry(texts, failed, target_language):
+                yield item
+
+    async def _retry(
+        self,
+        texts: Sequence[str],
+        failed: Sequence[int],
+        target_language: str,
+    ) -> AsyncIterator[tuple[int, str | None]]:
+        slots = asyncio.Semaphore(self.max_workers)
+
+        async def translate_one(i: int) -> str | None:
+            async with slots:
+                return await self._translate_one(texts[i], target_language)
+
+        tasks = [asyncio.create_task(translate_one(i)) for i in failed]
+        try:
+            for i, task in zip(failed, tasks, strict=True):
+                yield i, await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def batch_config(self) -> types.GenerateContentConfig:
+        from google.genai import types
+
+        return types.GenerateContentConfig(
+            system_instruction=SYSTEM_INSTRUCTION,
+            response_mime_type="application/json",
+            response_schema=list[TranslatedSegment],
+            thinking_config=self.thinking_config,
+        )
+
+    async def _translate_batch(
+        self,
+        batch: dict[int, str],
+        target_language: str,
+    ) -> dict[int, str]:
+        try:
+            with metrics.span(
+                "gemini.translate_batch",
+                model=self.model,
+                segments=len(batch),
+                chars=sum(len(text) for text in batch.values()),
+            ) as span:
+                started = time.perf_counter()
+                await self.rate_limiter.acquire()
+                span.set(rate_limit_wait=round(time.perf_counter() - started, 3))
+                response = await self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=batch_prompt(batch, target_language),
+                    config=self.batch_config(),
+                )
+        except Exception:
+            logger.exception("Batch of %d segments failed", len(batch))
+            return {}
+        return parse_batch(response, batch)
+
+    async def _translate_one(
+        self,
+        text: str,
+        target_language: str,
+    ) -> str | None:
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire()
+            try:
+                return await translate_text(
+                    self.client,
+                    self.model,
+                    text,
+                    target_language,
+                    thinking_config=self.thinking_config,
+                )
+            except ValueError:
+                raise  # blocked content, retrying will not help
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                metrics.count("retries")
+                logger.warning("Translation attempt %d failed", attempt + 1)
+                await asyncio.sleep(2**attempt)
+        return None
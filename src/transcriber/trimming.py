@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import subprocess
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from transcriber import metrics
+from transcriber.audio import CHUNK_SIZE, DEFAULT_PROFILE, encode_stream, probe
+from transcriber.chunking import detect_silences
+from transcriber.transcript import Segment, Transcript
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+    from transcriber.audio import Profile
+
+# Silences at least this long are cut, keeping some of them around the speech
+MIN_SILENCE_SECONDS = 1.0
+SILENCE_PADDING_SECONDS = 0.25
+# Whisper models lose accuracy on faster speech
+MAX_TEMPO = 1.5
+# The compressed audio is Opus, decoded at 48 kHz, when the model's profile
+# has no sample rate of its own
+OPUS_SAMPLE_RATE = 48_000
+SAMPLE_BYTES = 2
+
+
+@dataclass(slots=True)
+class TimeMap:
+    # Every kept piece starts at trimmed[i] in the trimmed audio and at
+    # original[i] in the original one, and is played `tempo` times faster
+    trimmed: list[float]
+    original: list[float]
+    tempo: float = 1.0
+
+    def to_original(self, t: float, end: bool = False) -> float:
+        # An end on a cut belongs to the piece before it, a start to the one after
+        find = bisect.bisect_left if end else bisect.bisect_right
+        i = max(find(self.trimmed, t) - 1, 0)
+        return self.original[i] + (t - self.trimmed[i]) * self.tempo
+
+    def restore(self, transcript: Transcript) -> Transcript:
+        return Transcript(
+            [
+                Segment(
+                    self.to_original(s.start),
+                    None if s.end is None else self.to_original(s.end, end=True),
+                    s.text,
+                    s.speaker,
+                )
+                for s in transcript.segments
+            ],
+            transcript.text,
+            transcript.num_speakers,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"trimmed": self.trimmed, "original": self.original, "tempo": self.tempo}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> TimeMap:
+        return cls(data["trimmed"], data["original"], data["tempo"])
+
+
+class Trimmed(NamedTuple):
+    time_map: TimeMap | None  # None when the audio is left as it is
+    audio_seconds: float
+    trimmed_seconds: float
+
+
+def plan_keep(
+    duration: float,
+    silences: Sequence[tuple[float, float]],
+    min_silence: float = MIN_SILENCE_SECONDS,
+    padding: float = SILENCE_PADDING_SECONDS,
+    sample_rate: int = OPUS_SAMPLE_RATE,
+) -> list[tuple[float, float]]:
+    # Sample-aligned pieces of the audio left after the long silences are cut
+    keep: list[tuple[float, float]] = []
+    start = 0.0
+    for silence_start, silence_end in silences:
+        if silence_end - silence_start < min_silence:
+            continue
+        cut_start = 0.0 if silence_start <= 0 else silence_start + padding
+        cut_end = duration if silence_end >= duration else silence_end - padding
+        if cut_start > start:
+            keep.append((start, cut_start))
+        start = max(start, cut_end)
+    if start < duration or not keep:
+        keep.append((start if keep else 0.0, duration))
+    return [
+        (round(a * sample_rate) / sample_rate, round(b * sample_rate) / sample_rate)
+        for a, b in keep
+    ]
+
+
+def pcm_args(sample_rate: int) -> list[str]:
+    return ["-f", "s16le", "-ac", "1", "-ar", str(sample_rate)]
+
+
+def kept_samples(
+    audio_file_name: Path,
+    keep: Sequence[tuple[float, float]],
+    sample_rate: int = OPUS_SAMPLE_RATE,
+) -> Iterator[bytes]:
+    # Decodes to raw PCM and drops the cut samples, so the map is exact
+    bounds = [
+        (round(a * sample_rate) * SAMPLE_BYTES, round(b * sample_rate) * SAMPLE_BYTES)
+        for a, b in keep
+    ]
+    args = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        str(audio_file_name),
+        *pcm_args(sample_rate),
+        "pipe:1",
+    ]
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ) as process:
+        assert process.stdout is not None  # noqa: S101
+        assert process.stderr is not None  # noqa: S101
+        position, i = 0, 0
+        while i < len(bounds) and (chunk := process.stdout.read(CHUNK_SIZE)):
+            end = position + len(chunk)
+            while i < len(bounds) and bounds[i][0] < end:
+                start, stop = bounds[i]
+                if stop > position:
+                    yield chunk[max(start - position, 0) : min(stop, end) - position]
+                if stop > end:
+                    break
+                i += 1
+            position = end
+        process.stdout.close()
+        stderr = process.stderr.read()
+    if process.returncode and i < len(bounds):  # not just stopped early
+        raise subprocess.CalledProcessError(
+            process.returncode,
+            args,
+            stderr=stderr.decode(errors="replace"),
+        )
+
+
+async def trim(
+    audio_file_name: Path,
+    trimmed_file_name: Path,
+    tempo: float = 1.0,
+    trim_silence: bool = True,
+    profile: Profile = DEFAULT_PROFILE,
+) -> Trimmed:
+    # Decoded at the rate the trimmed audio is encoded at
+    sample_rate = profile.sample_rate or OPUS_SAMPLE_RATE
+    with metrics.span("trim", tempo=tempo, trim_silence=trim_silence) as span:
+        if trim_silence:
+            duration, silences = await detect_silences(
+                audio_file_name,
+                min_silence=MIN_SILENCE_SECONDS,
+            )
+        else:
+            # Only sped up, the whole file is one piece
+            duration, silences = (await probe(audio_file_name))["duration"], []
+        keep = plan_keep(duration, silences, sample_rate=sample_rate)
+        trimmed: list[float] = []
+        position = 0.0
+        for start, end in keep:
+            trimmed.append(position / tempo)
+            position += end - start
+        result = Trimmed(
+            TimeMap(trimmed, [start for start, _ in keep], tempo),
+            duration,
+            position / tempo,
+        )
+        span.set(
+            audio_seconds=result.audio_seconds,
+            saved_seconds=result.audio_seconds - result.trimmed_seconds,
+        )
+        if len(keep) == 1 and tempo == 1 and duration - position < MIN_SILENCE_SECONDS:
+            return result._replace(time_map=None, trimmed_seconds=duration)
+        # Decoding, cutting and encoding again pipe blocking reads and writes
+        await asyncio.to_thread(
+            encode_stream,
+            kept_samples(audio_file_name, keep, sample_rate),
+            trimmed_file_name,
+            input_args=pcm_args(sample_rate),
+            filter_args=["-af", f"atempo={tempo}"] if tempo != 1 else [],
+            codec_args=profile.args,
+        )
+    return result
@@ -0,0 +1,120 @@
+import json
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    import replicate
+
+logger = logging.getLogger(__name__)
+
+
+class CachedVersion(NamedTuple):
+    version: str
+    fetched_at: float
+
+
+def parse_pins(value: str | None) -> dict[str, str]:
+    # Comma-separated list of owner/model:version pairs
+    pins: dict[str, str] = {}
+    for item in (value or "").split(","):
+        model, _, version = item.strip().partition(":")
+        if model and version:
+            pins[model] = version
+    return pins
+
+
+class ModelVersionResolver:
+    def __init__(
+        self,
+        client: replicate.Client,
+        ttl: float = 3600,
+        pins: dict[str, str] | None = None,
+        path: Path | None = None,
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.pins = pins or {}
+        self.path = path
+        self._versions: dict[str, CachedVersion] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.is_file():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+            self._versions = {m: CachedVersion(*v) for m, v in data.items()}
+        except ValueError, TypeError:
+            logger.warning("Ignoring unreadable model version cache %s", self.path)
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            data = {m: list(v) for m, v in self._versions.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Workers refresh at the same time, each writes its own file
+        f = tempfile.NamedTemporaryFile(  # noqa: SIM115
+            "w",
+            dir=self.path.parent,
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with f:
+                json.dump(data, f)
+            Path(f.name).replace(self.path)
+        except BaseException:
+            Path(f.name).unlink(missing_ok=True)
+            raise
+
+    def _fetch(self, model: str) -> str:
+        version = self.client.models.get(model).versions.list()[0].id
+        with self._lock:
+            self._versions[model] = CachedVersion(version, time.time())
+        self._save()
+        return version
+
+    def _refresh_in_background(self, model: str) -> None:
+        with self._lock:
+            if model in self._refreshing:
+                return
+            self._refreshing.add(model)
+
+        def refresh() -> None:
+            try:
+                self._fetch(model)
+            except Exception:
+                logger.exception(
+                    "Can't refresh %s version, keeping the cached one",
+                    model,
+                )
+            finally:
+                with self._lock:
+                    self._refreshing.discard(model)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def resolve(self, model: str) -> str:
+        if model in self.pins:
+            return self.pins[model]
+        with self._lock:
+            cached = self._versions.get(model)
+        if cached is None:
+            return self._fetch(model)
+        if time.time() - cached.fetched_at > self.ttl:
+            self._refresh_in_background(model)
+        return cached.version
+
+    def warm(self, models: Iterable[str]) -> None:
+        for model in models:
+            if model not in self.pins:
+                self._refresh_in_background(model)
@@ -0,0 +1,196 @@
+import asyncio
+import contextlib
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from transcriber import loop, metrics, settings
+from transcriber.errors import PipelineError
+from transcriber.jobs import Job, clean_up
+from transcriber.options import JobOptions
+from transcriber.pipeline import PipelineRun, run_pipeline
+from transcriber.services import Services
+from transcriber.store import JobStore, job_store
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from transcriber.store import JobRecord
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 60
+POLL_INTERVAL_SECONDS = 1.0
+CLEANUP_INTERVAL_SECONDS = 600
+
+
+class Worker:
+    # Jobs run as tasks of the shared I/O loop, so max_jobs can be far higher
+    # than the cores. Encoding and trimming use the CPU, at most one job per
+    # core does either at a time
+    def __init__(
+        self,
+        services: Services,
+        store: JobStore,
+        max_jobs: int = settings.max_concurrent_jobs,
+        poll_interval: float = POLL_INTERVAL_SECONDS,
+    ) -> None:
+        self.services = services
+        self.store = store
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.id = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._serving: Future[None] | None = None
+        self._maintainer = threading.Thread(
+            target=self._maintain,
+            name="job-lease",
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        metrics.configure_logging()
+        if settings.metrics_port:
+            metrics.serve(settings.metrics_port)
+        self._serving = asyncio.run_coroutine_threadsafe(self._serve(), loop.get())
+        self._maintainer.start()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._serving is not None:
+            with contextlib.suppress(TimeoutError):
+                self._serving.result(timeout)
+        self._maintainer.join(timeout)
+
+    def wait(self) -> None:
+        # Event.wait without a timeout can't be interrupted by signals
+        while not self._stop.wait(1):
+            pass
+
+    async def _serve(self) -> None:
+        limits = self._limits()
+        tasks: set[asyncio.Task[None]] = set()
+        while not self._stop.is_set():
+            record = None
+            if len(tasks) < self.max_jobs:
+                try:
+                    record = await asyncio.to_thread(
+                        self.store.claim,
+                        self.id,
+                        LEASE_SECONDS,
+                    )
+                except Exception:
+                    logger.exception("Can't claim a job")
+            if record is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            task = asyncio.create_task(self._process(record, limits))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Unfinished jobs are resumed by another worker once their lease expires
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _limits(self) -> dict[str, asyncio.Semaphore]:
+        cores = asyncio.Semaphore(os.process_cpu_count() or 1)
+        return {"encode": cores, "trim": cores}
+
+    def _maintain(self) -> None:
+        last_cleanup = 0.0
+        while not self._stop.wait(LEASE_SECONDS / 3):
+            try:
+                self.store.renew(self.id, LEASE_SECONDS)
+                if settings.metrics_file:
+                    metrics.registry.write(Path(settings.metrics_file))
+                if time.monotonic() - last_cleanup > CLEANUP_INTERVAL_SECONDS:
+                    self.clean_up_expired()
+                    last_cleanup = time.monotonic()
+            except Exception:
+                logger.exception("Job maintenance failed")
+
+    def process(self, record: JobRecord) -> None:
+        loop.run(self._process(record, self._limits()))
+
+    async def _process(
+        self,
+        record: JobRecord,
+        limits: dict[str, asyncio.Semaphore],
+    ) -> None:
+        # SQLite calls and file removals block, they are made in the loop's
+        # thread pool
+        job = Job(id=record.id, workdir=Path(record.workdir))
+        if record.attempts > self.store.max_attempts:
+            message = "The job was interrupted too many times."
+            await asyncio.to_thread(self.store.fail, job.id, message)
+            await asyncio.to_thread(remove_sources, job)
+            return
+        token = metrics.job_id.set(job.id)
+
+        async def save(stage: str, state: dict[str, Any]) -> None:
+            await asyncio.to_thread(self.store.save, job.id, stage, state)
+
+        try:
+            options = JobOptions.model_validate(record.options)
+            with metrics.span("job", model=options.model_name, attempt=record.attempts):
+                run = PipelineRun(
+                    self.services,
+                    job,
+                    options,
+                    record.state,
+                    save,
+                    encodes=limits["encode"],
+                )
+                await run_pipeline(run, limits)
+        except PipelineError as e:
+            await asyncio.to_thread(self.store.fail, job.id, str(e))
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            message = f"Repeat attempt! An error has occurred.\n\n{e}"
+            await asyncio.to_thread(self.store.fail, job.id, message)
+        else:
+            await asyncio.to_thread(self.store.finish, job.id)
+        finally:
+            metrics.job_id.reset(token)
+        # Interrupted and cancelled jobs keep their sources, they are resumed
+        await asyncio.to_thread(remove_sources, job)
+
+    def clean_up_expired(self) -> None:
+        before = time.time() - settings.job_retention_hours * 3600
+        for record in self.store.expired(before):
+            clean_up(Job(id=record.id, workdir=Path(record.workdir)))
+            self.store.delete(record.id)
+
+
+def remove_sources(job: Job) -> None:
+    # Only the compressed audio is kept to be played back with the results
+    for path in job.workdir.iterdir():
+        if path == job.converted_file:
+            continue
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    worker = Worker(Services.from_env(), job_store())
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    worker.start()
+    logger.info("Worker %s is running %d jobs at a time", worker.id, worker.max_jobs)
+    try:
+        worker.wait()
+    except KeyboardInterrupt:
+        # Unfinished jobs are resumed by another worker once their lease expires
+        worker.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    main()